@@ -26,23 +26,35 @@ How to Use:
      ```
      python pyScan.py <confile>
      ```
+   - Check a configuration without touching the hardware (`--plan` also prints the action tree):
+     ```
+     python pyScan.py <confile> --validate
+     python pyScan.py <confile> --plan
+     ```
+   - Run many configurations in one go, keeping the hardware connected between them:
+     ```
+     python pyScan.py --batch first.con second.con overnight_scans/
+     ```
    - From Spyder:
      ```
      runfile('<path-to-pyScan.py>', args='<confile>')
      ```
 
-3. Logs and data files will be saved in the working directory or an optional dedicated folder (to be implemented).
+3. Parameters are declared by each action class (PARAMETERS) and checked for the whole file before any hardware is
+   opened. Unknown parameters and bad values are reported with their line number.
+   Any action can be given `process true` to run it, with its children, in a worker process of its own.
+   A top-level `memory_budget 4 GB [fail/spill]` line (or `--memory-budget 4GB [--spill]`) limits buffer memory.
+
+4. Logs and data files will be saved in the working directory or an optional dedicated folder (to be implemented).
 
 Known Bugs/Flaws/Limitations:
 -----------------------------
-1. **Beep Action Limitation**: The current implementation of the "beep" action does not preserve the exact order of 
-   "beep" and "boop" commands from the configuration file due to dictionary-based parameter parsing.
-2. **File Handling**: No user interaction to handle existing files (overwrite/append/rename). Planned improvement.
-3. **Stage Precision**: Movements are subject to hardware-specific precision limits. Users must ensure compatibility.
-4. **Error Handling**: Exceptions are caught and logged, but some actions may not gracefully recover from critical errors.
-5. **Logging**: Console output is not yet logged to a file (planned improvement).
-6. **Cross-platform Issues**: Some features, like hardware detection, may behave differently on Linux vs. Windows.
-7. **Repeated actions**: Unknown behaviour for repeated A2D actions, probably the system cannot deal with it.
+1. **File Handling**: No user interaction to handle existing files (overwrite/append/rename). Planned improvement.
+2. **Stage Precision**: Movements are subject to hardware-specific precision limits. Users must ensure compatibility.
+3. **Error Handling**: Exceptions are caught and logged, but some actions may not gracefully recover from critical errors.
+4. **Logging**: Console output is not yet logged to a file (planned improvement).
+5. **Cross-platform Issues**: Some features, like hardware detection, may behave differently on Linux vs. Windows.
+6. **Repeated actions**: Unknown behaviour for repeated A2D actions, probably the system cannot deal with it.
 
 Authors:
 --------
@@ -52,6 +64,17 @@ Authors:
 
 import importlib
 import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from py_registry import ActionRegistry
+from py_actor import share_budget, spawn_actors
+from py_memory import budget, parse_size
+from py_session import sessions
 #from py_common import Action
 
 def read_config_file(confile):
@@ -62,39 +85,57 @@ def read_config_file(confile):
 class ActionParser:
     def __init__(self, confile):
         self.confile = confile
-        self.filebase = confile.split(".")[0]  # Get the base name without extension
+        self.filebase = os.path.splitext(confile)[0]  # Get the base name without extension
         self.actions = []
         self.imported_modules = {}
+        self.registry = None
+        self.errors = []  # Problems found while parsing, as "<confile>:<line>: message"
+        self.memory_limit = None  # Run-wide buffer memory budget in bytes, from a top-level memory_budget line
+        self.memory_spill = False
 
     def parse(self):
         with open(self.confile, 'r') as file:
             config_lines = file.readlines()
 
+        # Find out which module defines each action without importing any of them
+        if self.registry is None:
+            self.registry = ActionRegistry().load()
+
         parent_action = None
         current_action = None
+        skipped_depth = 0  # Nesting depth inside an action that could not be created
 
-        for line in config_lines:
+        for line_number, line in enumerate(config_lines, start=1):
             words = line.strip().split()
             if not words:
                 continue  # Skip empty lines
 
             word = words[0]
 
-            if word == "action":
-                module_name = "py_" + words[1]  # Assuming the module name follows the word 'action'
-                class_name = words[1]           # Use the action name directly for the class name
+            if word == "action" and skipped_depth:
+                skipped_depth += 1
+            elif word == "action":
+                class_name = words[1] if len(words) > 1 else ""  # Use the action name directly for the class name
+                # Modules are normally named py_<action>, but the registry knows where each action really lives
+                module_name = self.registry.module_for(class_name) or "py_" + class_name
                 try:
                     # Store the imported module in a dictionary if not already imported
                     if module_name not in self.imported_modules:
                         # Dynamically import the module
-                        imported_module = importlib.import_module(module_name)
-                        # Store it
-                        self.imported_modules[module_name] = imported_module
+                        self.imported_modules[module_name] = importlib.import_module(module_name)
                         print(f"Successfully imported module: {module_name}")
+                    imported_module = self.imported_modules[module_name]
 
                     # Get the specific class (e.g., A2D or asiScan) from the module and instantiate it
                     action_class = getattr(imported_module, class_name)
                     current_action = action_class(self.filebase)  # Pass filebase to the action instance
+                    current_action.line_number = line_number
+
+                    # Name it by its position in the tree, counting earlier siblings of the same type
+                    siblings = parent_action.child_actions if parent_action else self.actions
+                    index = sum(1 for sibling in siblings if sibling.__class__ is action_class)
+                    prefix = f"{parent_action.path}/" if parent_action else ""
+                    current_action.path = f"{prefix}{class_name}[{index}]"
 
                     # Add current_action as a child if inside another action, otherwise add it to main actions
                     if parent_action:
@@ -107,20 +148,87 @@ class ActionParser:
                     parent_action = current_action
 
                 except (ImportError, AttributeError) as e:
-                    print(f"Error importing or instantiating {class_name} from {module_name}: {e}")                
+                    known = ", ".join(sorted(self.registry.actions))
+                    self.report(line_number, f"Error importing or instantiating {class_name} from {module_name}: {e}"
+                                             f" (known actions: {known})")
+                    # Ignore everything up to the matching 'end'
+                    skipped_depth = 1
+                    current_action = None
             elif word == "end":
+                if skipped_depth:
+                    skipped_depth -= 1
                 # Move up one level in the action hierarchy if 'end' is encountered
-                if parent_action:
+                elif parent_action:
                     parent_action = parent_action.parent if hasattr(parent_action, 'parent') else None
 
-            elif word!= '#':
+            elif word == "memory_budget" and parent_action is None:
+                # memory_budget <size> [unit] [fail/spill], outside any action
+                policy = words[-1].lower() if words[-1].lower() in ["fail", "spill"] else None
+                try:
+                    self.memory_limit = parse_size(words[1:-1] if policy else words[1:])
+                    self.memory_spill = policy == "spill"
+                except ValueError as e:
+                    self.report(line_number, f"memory_budget: {e}")
+
+            elif word!= '#' and not skipped_depth:
                 # Let the current action parse its specific line
                 if current_action:
                     current_action.parse_line(words)
 
+    def report(self, line_number, message):
+        """Record a problem with the configuration file and print it."""
+        error = f"{self.confile}:{line_number}: {message}"
+        self.errors.append(error)
+        print(error)
+
+    def plan(self):
+        """Print the parsed action tree and its parameters without touching any hardware."""
+        def show(action, depth):
+            # Compiled parameters include the defaults, fall back to the raw strings if they did not compile
+            if action.params is not None:
+                parameters = " ".join(f"{name}={getattr(action.params, name)!r}" for name in action.params.__slots__)
+            else:
+                parameters = " ".join(f"{key}={value}" for key, value in action.parameters.items())
+            print(f"{'    ' * depth}{action.path}  {parameters}")
+            for child_action in action.child_actions:
+                show(child_action, depth + 1)
+
+        for action in self.actions:
+            show(action, 0)
+
+    def validate(self):
+        """
+        Compile and check the parameters of every action, returning the list of problems found.
+
+        Runs before any hardware is opened, so a mistake in the .con file is reported straight away.
+        """
+        def check(action):
+            try:
+                action.compile_parameters()
+            except ValueError as e:
+                self.report(action.line_number, f"{action.path}: {e}")
+            for child_action in action.child_actions:
+                check(child_action)
+
+        for action in self.actions:
+            check(action)
+        if not self.actions and not self.errors:
+            self.report(0, "No actions found.")
+        return self.errors
+
+    def metadata_filename(self):
+        return f"{self.filebase}_metadata.json"
+
     def setup_actions(self):
         """Set up all actions in sequence."""
         print("Starting setup of actions...")
+        # Checked before any action opens its files, so a repeated run cannot replace the earlier run's metadata
+        filename = self.metadata_filename()
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        # Subtrees marked 'process true' are handed to worker processes
+        self.actions = spawn_actors(self.actions, self.confile)
+        share_budget(self.actions)
         for action in self.actions:
             action.setup()
         print("Setup of actions completed.")
@@ -139,6 +247,122 @@ class ActionParser:
             action.cleanup()
         print("Cleanup of actions completed.")
 
+    def write_metadata(self):
+        """Save the metadata recorded by the actions during the run to <confile>_metadata.json."""
+        metadata = {}
+        for action in self.actions:
+            metadata.update(action.metadata_by_path())
+        memory = budget.report()
+        if metadata or budget.peak:
+            filename = self.metadata_filename()
+            with open(filename, 'x') as file:
+                json.dump({"confile": self.confile, "actions": metadata, "memory": memory}, file, indent=4)
+            print(f"Run metadata saved to {filename}.")
+
+
+def prepare(confile):
+    """Parse and validate a configuration, returning the parser and the time it took."""
+    started = time.perf_counter()
+    action_parser = ActionParser(confile)
+    try:
+        action_parser.parse()
+        action_parser.validate()
+    except OSError as e:
+        action_parser.report(0, str(e))
+    return action_parser, time.perf_counter() - started
+
+
+def configure_memory(action_parser, args):
+    """Apply the memory budget of the file, or the one given on the command line which takes precedence."""
+    if args.memory_budget is not None:
+        action_parser.memory_limit = args.memory_budget
+    budget.configure(action_parser.memory_limit, action_parser.memory_spill or args.spill)
+
+
+def run_configuration(action_parser):
+    """Set up, run and clean up a validated configuration, returning the time spent in each stage."""
+    timings = {}
+    set_up = False
+    started = time.perf_counter()
+    try:
+        action_parser.setup_actions()
+        set_up = True
+        timings["setup"] = time.perf_counter() - started
+        started = time.perf_counter()
+        action_parser.run_actions()
+        timings["run"] = time.perf_counter() - started
+    finally:
+        started = time.perf_counter()
+        action_parser.cleanup_actions()
+        if set_up:
+            # A run that never got going has nothing to record
+            action_parser.write_metadata()
+        timings["cleanup"] = time.perf_counter() - started
+    return timings
+
+
+def batch_files(paths):
+    """Expand directories into the .con files they contain, in name order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.con"))))
+        else:
+            files.append(path)
+    return files
+
+
+def run_batch(paths, args):
+    """
+    Run many configurations in one process.
+
+    Hardware sessions are kept open between files, so a file using the same DAQ channels, serial port, piezo or
+    camera as the previous one does not reconnect. The next file is parsed and validated in the background while
+    the current one runs. A failing file is reported and the batch goes on with the next one.
+    """
+    files = batch_files(paths)
+    if not files:
+        print("No .con files to run.")
+        return 1
+    sessions.keep_open = True
+    summary = []
+    batch_started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare") as preparer:
+            upcoming = preparer.submit(prepare, files[0])
+            for number, confile in enumerate(files):
+                action_parser, parse_time = upcoming.result()
+                print(f"\n=== Batch {number + 1}/{len(files)}: {confile} ===")
+                if number + 1 < len(files):
+                    upcoming = preparer.submit(prepare, files[number + 1])
+                row = {"confile": confile, "parse": parse_time, "status": "ok"}
+                if action_parser.errors:
+                    row["status"] = f"invalid ({len(action_parser.errors)} problem(s))"
+                    summary.append(row)
+                    continue
+                budget.reset()
+                configure_memory(action_parser, args)
+                started = time.perf_counter()
+                try:
+                    row.update(run_configuration(action_parser))
+                except Exception as e:
+                    traceback.print_exc()
+                    row["status"] = f"failed: {e.__class__.__name__}"
+                row["total"] = time.perf_counter() - started
+                summary.append(row)
+    finally:
+        sessions.close_all()
+
+    print(f"\nBatch of {len(files)} file(s) finished in {time.perf_counter() - batch_started:.1f} s, "
+          f"{sessions.opened} hardware session(s) opened, {sessions.reused} reused.")
+    width = max(len(row["confile"]) for row in summary)
+    print(f"{'file':<{width}}  {'parse':>7}  {'setup':>7}  {'run':>8}  {'cleanup':>7}  {'total':>8}  status")
+    for row in summary:
+        times = "  ".join(f"{row[key]:{size}.2f}" if key in row else " " * size
+                          for key, size in [("parse", 7), ("setup", 7), ("run", 8), ("cleanup", 7), ("total", 8)])
+        print(f"{row['confile']:<{width}}  {times}  {row['status']}")
+    return 0 if all(row["status"] == "ok" for row in summary) else 1
+
 
 # Example usage
 if __name__ == "__main__":
@@ -151,14 +375,33 @@ if __name__ == "__main__":
             default="trapped_bead_2.con",
             help="Path to the .con configuration file (default: default.con)."
         )
+    parser.add_argument("--plan", action="store_true",
+                        help="Parse the configuration and print the action tree without running it.")
+    parser.add_argument("--validate", action="store_true",
+                        help="Parse and check the configuration without opening any hardware.")
+    parser.add_argument("--memory-budget", type=parse_size, default=None,
+                        help="Limit on buffer memory for the run, e.g. 4GB (overrides memory_budget in the file).")
+    parser.add_argument("--spill", action="store_true",
+                        help="Spill buffers that do not fit the memory budget to disk instead of failing.")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="Run several .con files (or every .con file in a directory) in one process, "
+                             "keeping hardware connected between them.")
     # Parse arguments
     args = parser.parse_args()
 
-    # Create an ActionParser instance and run the experiment
-    try:
-        parser = ActionParser(args.confile)
-        parser.parse()
-        parser.setup_actions()
-        parser.run_actions()
-    finally:
-        parser.cleanup_actions()
+    if args.batch:
+        sys.exit(run_batch(args.batch, args))
+
+    # Create an ActionParser instance and check the whole configuration before touching any hardware
+    action_parser = ActionParser(args.confile)
+    action_parser.parse()
+    errors = action_parser.validate()
+    if args.plan:
+        action_parser.plan()
+    if errors or args.plan or args.validate:
+        print(f"{args.confile}: {len(errors)} problem(s) found." if errors else f"{args.confile} is valid.")
+        sys.exit(1 if errors else 0)
+
+    # Run the experiment
+    configure_memory(action_parser, args)
+    run_configuration(action_parser)
@@ -0,0 +1,288 @@
+"""
+Camera action for pyScan. The camera stays open from setup to cleanup and every run captures one or more frames
+into a preallocated ring buffer. A writer thread appends the frames to a raw stack on disk, so the capture loop
+never waits on file I/O or compression.
+
+Supported parameters:
+    camera [thorlabs]/simulated
+    serial_number serial        # Thorlabs only, optional if a single camera is connected
+    exposure 50                 # ms
+    gain 1.0                    # Thorlabs only, ignored if the camera has no gain control
+    frames 1                    # frames captured per run
+    ring 64                     # frames held in the ring buffer
+    compress [none]/zlib        # done on the writer thread
+    fps 30                      # simulated only
+    size 512 512                # simulated only, height width
+
+Output files, <tag> being the action path, e.g. count0_ThorlabsCamera0:
+    <confile>_<tag>_camera.bin        frame stack. Uncompressed it is a plain (frames, height, width) array that
+                                      can be opened with np.memmap, compressed it is a sequence of zlib blocks
+    <confile>_<tag>_camera_index.bin  int64 rows of (timestamp_ns, frame, scan_index, offset, nbytes, *loop_indices)
+    <confile>_<tag>_camera.json       dtype, frame shape, compression and index columns needed to read the two above
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from py_common import Action, Param, cached_discovery, ints
+from py_memory import budget
+from py_session import sessions
+
+
+class SimulatedCamera:
+    """Stand-in camera producing frames at a fixed rate, for testing without hardware."""
+
+    def __init__(self, fps=30.0, shape=(512, 512), dtype=np.uint16):
+        self.fps = fps
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.period_ns = int(1e9 / fps)
+        self.next_frame_ns = 0
+        self.frame_number = 0
+        self.pattern = None
+
+    def open(self):
+        """Prepare the frame pattern and start the frame clock."""
+        rows, cols = np.indices(self.shape)
+        self.pattern = ((rows + cols) % 1024).astype(self.dtype)
+        self.next_frame_ns = time.perf_counter_ns()
+
+    def flush(self):
+        """Skip frames missed since the last read, as a free-running camera would."""
+        now = time.perf_counter_ns()
+        if now > self.next_frame_ns:
+            missed = (now - self.next_frame_ns) // self.period_ns + 1
+            self.next_frame_ns += missed * self.period_ns
+            self.frame_number += missed
+
+    def read_frame(self, out):
+        """Wait for the next frame, write it into `out` and return its timestamp in ns."""
+        delay = self.next_frame_ns - time.perf_counter_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        np.add(self.pattern, self.frame_number % 1024, out=out, casting="unsafe")
+        self.next_frame_ns += self.period_ns
+        self.frame_number += 1
+        return time.time_ns()
+
+    def close(self):
+        self.pattern = None
+
+
+class ThorlabsScientificCamera:
+    """Thorlabs scientific camera through pylablib, kept acquiring between runs."""
+
+    def __init__(self, serial_number=None, exposure=50.0, gain=None):
+        self.serial_number = serial_number
+        self.exposure = exposure
+        self.gain = gain
+        self.device = None
+        self.shape = None
+        self.dtype = np.dtype(np.uint16)
+
+    def open(self):
+        """Connect, configure and start continuous acquisition."""
+        from pylablib.devices import Thorlabs  # Imported here, pylablib is slow to load
+
+        def list_cameras():
+            return list(Thorlabs.list_cameras_tlcam())
+
+        cameras = cached_discovery("tlcam_cameras", list_cameras)
+        if self.serial_number is not None and self.serial_number not in cameras:
+            # The cached list may predate the camera being plugged in
+            cameras = cached_discovery("tlcam_cameras", list_cameras, refresh=True)
+        if not cameras:
+            raise RuntimeError("No Thorlabs cameras found.")
+        if self.serial_number is None:
+            if len(cameras) > 1:
+                raise ValueError(f"Several cameras found {cameras}, please give a serial_number.")
+            self.serial_number = cameras[0]
+            print(f"Auto-detected camera: {self.serial_number}")
+        elif self.serial_number not in cameras:
+            raise ValueError(f"Specified camera serial number {self.serial_number} not found.")
+
+        def connect():
+            device = Thorlabs.ThorlabsTLCamera(serial=self.serial_number)
+            device.start_acquisition()
+            return device
+
+        def disconnect(device):
+            device.stop_acquisition()
+            device.close()
+            print(f"Closed connection to camera: {self.serial_number}")
+
+        # A batch reuses the camera left acquiring by the previous configuration
+        self.device = sessions.acquire(("tlcam", self.serial_number), connect, disconnect)
+        self.device.set_exposure(self.exposure / 1000)
+        if self.gain is not None and hasattr(self.device, "set_gain"):
+            self.device.set_gain(self.gain)
+        self.shape = tuple(self.device.get_data_dimensions())
+        print(f"Connected to Thorlabs camera {self.serial_number}, frame shape {self.shape}.")
+
+    def flush(self):
+        """Drop frames buffered since the last read, so the next frame is taken after this call."""
+        self.device.read_multiple_images()
+
+    def read_frame(self, out):
+        """Wait for the next frame, copy it into `out` and return its timestamp in ns."""
+        self.device.wait_for_frame(timeout=max(1.0, 10 * self.exposure / 1000))
+        timestamp = time.time_ns()
+        out[...] = self.device.read_oldest_image()
+        return timestamp
+
+    def close(self):
+        if self.device is not None:
+            sessions.release(("tlcam", self.serial_number))
+            self.device = None
+
+
+class ThorlabsCamera(Action):
+    PARAMETERS = {
+        "camera": Param(str, "thorlabs", choices=["thorlabs", "simulated"]),
+        "serial_number": Param(str),
+        "exposure": Param(float, 50.0),
+        "gain": Param(float),
+        "frames": Param(int, 1),
+        "ring": Param(int, 64),
+        "compress": Param(str, "none", choices=["none", "zlib"]),
+        "fps": Param(float, 30.0),
+        "size": Param(ints, [512, 512], nargs=2),
+    }
+
+    def __init__(self, filebase):
+        super().__init__(filebase)
+        self.camera = None
+        self.frames = 1
+        self.compress = "none"
+        self.ring = None          # Preallocated (slots, height, width) frame buffer
+        self.free_slots = None    # Counts ring slots the writer has finished with
+        self.next_slot = 0
+        self.frame_queue = queue.Queue()
+        self.writer = None
+        self.writer_error = None
+        self.run_index = 0        # Scan index, one per call to run
+        self.frame_number = 0
+        self.stack_file = None
+        self.index_file = None
+
+    def check_parameters(self):
+        if self.params.frames < 1 or self.params.ring < 1:
+            raise ValueError("frames and ring must be at least 1")
+        if self.params.fps <= 0:
+            raise ValueError("fps must be positive")
+
+    def setup(self):
+        """Open the camera, allocate the ring buffer and start the writer thread."""
+        super().setup()
+
+        self.frames = self.params.frames
+        self.compress = self.params.compress
+
+        if self.params.camera == "simulated":
+            self.camera = SimulatedCamera(fps=self.params.fps, shape=self.params.size)
+        else:
+            self.camera = ThorlabsScientificCamera(serial_number=self.params.serial_number,
+                                                   exposure=self.params.exposure,
+                                                   gain=self.params.gain)
+        self.camera.open()
+
+        slots = self.params.ring
+        self.ring = budget.allocate(self.path, (slots,) + self.camera.shape, self.camera.dtype)
+        self.free_slots = threading.BoundedSemaphore(slots)
+        print(f"Camera ring buffer: {slots} frames of {self.camera.shape} {self.camera.dtype}.")
+
+        base = f"{self.confile_name}_{self.file_tag()}_camera"
+        stack_name = f"{base}.bin"
+        index_name = f"{base}_index.bin"
+        description_name = f"{base}.json"
+        for filename in [stack_name, index_name, description_name]:
+            if os.path.exists(filename):
+                raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        self.stack_file = open(stack_name, "wb")
+        self.index_file = open(index_name, "wb")
+
+        loop_columns = [f"loop{i}" for i in range(len(self.loop_indices()))]
+        with open(description_name, "x") as file:
+            json.dump({"dtype": self.camera.dtype.str,
+                       "shape": list(self.camera.shape),
+                       "compress": self.compress,
+                       "index_columns": ["timestamp_ns", "frame", "scan_index", "offset", "nbytes"] + loop_columns},
+                      file, indent=4)
+
+        self.writer = threading.Thread(target=self.write_frames, name="camera-writer", daemon=True)
+        self.writer.start()
+        print(f"Frames will be saved to {stack_name}.")
+
+    def write_frames(self):
+        """Writer thread: append queued ring slots to the stack file, compressing if requested."""
+        offset = 0
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                break
+            slot, timestamp, frame_number, run_index, loop_indices = item
+            try:
+                try:
+                    if self.compress == "zlib":
+                        payload = zlib.compress(self.ring[slot], 1)
+                    else:
+                        payload = None
+                        self.ring[slot].tofile(self.stack_file)
+                finally:
+                    # Done with the slot, whether or not that worked. Released exactly once, so the capture side
+                    # never reuses a slot that is still queued, and never blocks on a dead writer
+                    self.free_slots.release()
+                if payload is not None:
+                    self.stack_file.write(payload)
+                    nbytes = len(payload)
+                else:
+                    nbytes = self.ring[slot].nbytes
+                row = [timestamp, frame_number, run_index, offset, nbytes] + loop_indices
+                np.array(row, dtype=np.int64).tofile(self.index_file)
+                offset += nbytes
+            except Exception as e:
+                self.writer_error = e  # Reported on the next run
+
+    def run(self):
+        """Capture the requested frames into the ring buffer and hand them to the writer."""
+        if self.writer_error is not None:
+            raise RuntimeError(f"Camera writer failed: {self.writer_error}")
+
+        loop_indices = self.loop_indices()
+        self.camera.flush()
+        for _ in range(self.frames):
+            # Blocks only if the writer is a whole ring behind
+            self.free_slots.acquire()
+            slot = self.next_slot
+            timestamp = self.camera.read_frame(self.ring[slot])
+            self.frame_queue.put((slot, timestamp, self.frame_number, self.run_index, loop_indices))
+            self.next_slot = (slot + 1) % len(self.ring)
+            self.frame_number += 1
+        print(f"Captured {self.frames} frame(s) for scan index {self.run_index}.")
+        self.run_index += 1
+
+        self.run_children()
+
+    def cleanup(self):
+        """Flush the writer, close the files and disconnect the camera."""
+        if self.writer is not None:
+            self.frame_queue.put(None)
+            self.writer.join()
+            self.writer = None
+            print(f"Camera writer finished, {self.frame_number} frames written.")
+        for file in [self.stack_file, self.index_file]:
+            if file is not None:
+                file.close()
+        if self.camera is not None:
+            self.camera.close()
+        budget.free(self.ring)
+        self.ring = None
+        if self.writer_error is not None:
+            print(f"Camera writer reported an error: {self.writer_error}")
+        super().cleanup()
@@ -6,14 +6,16 @@ Created on Thu Nov 21 13:40:49 2024
 @curator: Will Hardiman
 """
 
-from py_common import Stage1D
-from pylablib.devices import Thorlabs
+from py_common import Param, cached_discovery
+from py_session import sessions
+from py_stage import Stage1D
 
 class ThorlabsPiezoStage(Stage1D):
     """
     Class to control a Thorlabs PFM450 piezo stage using the pylablib library.
     Inherits from Stage1D.
     """
+    PARAMETERS = {"serial_number": Param(str)}
 
     def __init__(self, filebase):
         super().__init__(filebase)
@@ -22,14 +24,22 @@ class ThorlabsPiezoStage(Stage1D):
 
     def setup(self):
         """Set up the Thorlabs Piezo Stage connection."""
-        super().setup()  # Call parent setup to parse parameters
-
-        # Get the list of connected Kinesis devices
-        devices = Thorlabs.list_kinesis_devices()
-        piezo_devices = [dev for dev in devices if "Piezo Controller" in dev[1]]
+        from pylablib.devices import Thorlabs  # Imported here, pylablib is slow to load
 
+        if self.params is None:
+            self.compile_parameters()
         # Check for serial number in the parameters
-        self.serial_number = self.parameters.get("serial_number", None)
+        self.serial_number = self.params.serial_number
+
+        # Get the list of connected Kinesis devices, enumeration is slow so a recent result is reused
+        def list_devices():
+            return [list(dev) for dev in Thorlabs.list_kinesis_devices()]
+
+        devices = cached_discovery("kinesis_devices", list_devices)
+        if self.serial_number is not None and self.serial_number not in [dev[0] for dev in devices]:
+            # The cached list may predate the device being plugged in
+            devices = cached_discovery("kinesis_devices", list_devices, refresh=True)
+        piezo_devices = [dev for dev in devices if "Piezo Controller" in dev[1]]
 
         if not piezo_devices:
             raise RuntimeError("No Thorlabs piezo devices found.")
@@ -41,9 +51,20 @@ class ThorlabsPiezoStage(Stage1D):
             # If a serial number is specified, validate it
             raise ValueError(f"Specified serial number {self.serial_number} not found.")
         
-        # Connect to the piezo device
-        self.device = Thorlabs.KinesisPiezo(self.serial_number)
-        print(f"Connected to Thorlabs Piezo Controller: {self.serial_number}")
+        # Connect to the piezo device, or take over the connection a previous configuration of a batch left open
+        def connect():
+            device = Thorlabs.KinesisPiezo(self.serial_number)
+            print(f"Connected to Thorlabs Piezo Controller: {self.serial_number}")
+            return device
+
+        def disconnect(device):
+            device.close()
+            print(f"Closed connection to piezo device: {self.serial_number}")
+
+        self.device = sessions.acquire(("kinesis", self.serial_number), connect, disconnect)
+
+        # Parent setup builds the scan grid, which needs the device to read the current position
+        super().setup()
 
     def go_to(self, point):
         """Move the piezo stage to the specified position."""
@@ -62,7 +83,7 @@ class ThorlabsPiezoStage(Stage1D):
 
     def cleanup(self):
         """Clean up the device connection."""
+        super().cleanup()  # Moves back to the start position for restore, so the device is still needed
         if self.device:
-            self.device.close()
-            print(f"Closed connection to piezo device: {self.serial_number}")
-        super().cleanup()  # Call parent cleanup
+            sessions.release(("kinesis", self.serial_number))
+            self.device = None
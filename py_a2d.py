@@ -1,10 +1,112 @@
 import os
-from py_common import Action  # Import the Action superclass
-import nidaqmx
-from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+import time
+from py_common import Action, Param, boolean, words  # Import the Action superclass
 import numpy as np
+from py_monitor import SharedRingBuffer
+from py_container import ContainerWriter
+from py_compress import CODECS, CompressedWriter, load_codec
+from py_memory import budget
+from py_session import sessions
+from py_stream import DEFAULT_ADDRESS, StreamServer, parse_address
+
+READ_CHUNK = 10000  # Samples per channel read from the DAQ in one go
+MISSING_TIMESTAMP = np.iinfo(np.int64).min  # start_ns of a record whose DAQ start time could not be read
+
+
+def close_daq_tasks(session):
+    """Close the tasks of a DAQ session made by A2D.open_daq."""
+    for task in session[0]:
+        task.close()
+    print("DAQ tasks closed.")
+
+
+class DeadTimeStats:
+    """Running summary of the dead time between consecutive records, without keeping every value."""
+    BIN_EDGES = np.logspace(2, 11, 91)  # 100 ns to 100 s, 10 bins per decade, for approximate percentiles
+
+    def __init__(self, record_ns):
+        self.record_ns = record_ns  # Length of one record
+        self.records = 0
+        self.first_start = None
+        self.previous_start = None  # None after a record without a start time, so no gap is measured across it
+        self.last_start = None
+        self.missing = 0
+        self.unplaced = 0  # Missing records since the last known start
+        self.gaps = 0
+        self.total = 0
+        self.total_sq = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.histogram = np.zeros(len(self.BIN_EDGES) + 1, dtype=np.int64)
+
+    def add(self, start_ns):
+        """Account for a record starting at start_ns, on the same clock as the previous ones."""
+        if self.first_start is None:
+            self.first_start = start_ns
+        elif self.previous_start is not None:
+            dead = start_ns - self.previous_start - self.record_ns
+            self.gaps += 1
+            self.total += dead
+            self.total_sq += float(dead) ** 2
+            self.minimum = dead if self.minimum is None else min(self.minimum, dead)
+            self.maximum = dead if self.maximum is None else max(self.maximum, dead)
+            self.histogram[np.searchsorted(self.BIN_EDGES, dead)] += 1
+        self.previous_start = self.last_start = start_ns
+        self.records += self.unplaced + 1
+        self.unplaced = 0
+
+    def add_missing(self):
+        """Account for a record whose start time is unknown. The gaps on either side of it are not measured."""
+        self.previous_start = None
+        self.missing += 1
+        self.unplaced += 1
+
+    def percentile(self, q):
+        """Upper edge of the histogram bin holding the q-th percentile of the dead time, at most the maximum."""
+        position = np.searchsorted(np.cumsum(self.histogram), q / 100 * self.gaps)
+        return min(float(self.BIN_EDGES[min(position, len(self.BIN_EDGES) - 1)]), float(self.maximum))
+
+    def summary(self):
+        if not self.gaps:
+            return {"records": self.records + self.unplaced, "missing_timestamps": self.missing}
+        mean = self.total / self.gaps
+        span = self.last_start + self.record_ns - self.first_start
+        return {
+            "records": self.records + self.unplaced,
+            "missing_timestamps": self.missing,
+            "record_ns": self.record_ns,
+            "dead_time_mean_ns": mean,
+            "dead_time_std_ns": max(self.total_sq / self.gaps - mean ** 2, 0.0) ** 0.5,
+            "dead_time_min_ns": int(self.minimum),
+            "dead_time_max_ns": int(self.maximum),
+            "dead_time_median_ns": self.percentile(50),
+            "dead_time_p99_ns": self.percentile(99),
+            "efficiency": self.records * self.record_ns / span,
+        }
 
 class A2D(Action):
+    PARAMETERS = {
+        "channels": Param(words, nargs="+", required=True),
+        "timestamps": Param(boolean, False),  # <confile>_<tag>_timestamps.bin and dead time statistics
+        "range": Param(float, 10.0),
+        "rate": Param(int, 10000),
+        "samples": Param(int, 1000),
+        "device": Param(str, "Dev1"),
+        "print": Param(boolean, False),
+        "format": Param(str, "bin", choices=["bin", "container", "compressed"]),
+        "codec": Param(str, "zlib", choices=CODECS),
+        "compress_level": Param(int),
+        "chunk_samples": Param(int, 16384),
+        "compress_threads": Param(int),
+        "monitor": Param(boolean, False),
+        "monitor_name": Param(str),
+        "monitor_decimate": Param(int, 1),
+        "monitor_slots": Param(int, 16),
+        "stream": Param(boolean, False),
+        "stream_address": Param(str, DEFAULT_ADDRESS),
+        "stream_queue": Param(int, 64),
+    }
+
     def __init__(self, confile_name):
         super().__init__(confile_name)
         self.channels = []
@@ -14,64 +116,245 @@ class A2D(Action):
         self.data = []         # To hold acquired data
         self.task = None         # DAQ task handle (initialized in setup)
         self.device = "Dev1"
+        self.channel_specs = []  # (device, channel) pair for each entry in self.channels
+        self.tasks = []          # One task per device, the first one is the master
+        self.task_rows = []      # Rows of self.data filled by each task
+        self.task_blocks = []    # Row slice of self.data for each task, None if its rows are not consecutive
+        self.readers = []        # Stream readers matching self.tasks
+        self.daq_key = None      # Session pool key describing the task configuration
         self.data_file_handles = []
+        self.format = "bin"      # bin: one file per channel, container: shared <confile>.pyscan, compressed: chunked
+        self.container = None
+        self.compressed = None   # CompressedWriter for the compressed format
+        self.stream_id = None
+        self.interleaved = None  # (samples, channels) copy of self.data for the container
+        self.record_timestamp = 0  # time.time_ns() at the start of the latest record
+        self.hardware_timestamps = False  # Whether the master task reports its first sample time
+        self.timestamp_clock = None       # "daq" or "perf_counter", decided on the first record and kept
+        self.timestamp_file = None        # int64 rows of (start_ns, *loop_indices)
+        self.timestamp_row = None
+        self.dead_time = None
+        self.monitor = None      # Shared memory ring buffer for live viewers, if enabled
+        self.monitor_decimate = 1
+        self.monitor_bytes = 0   # Shared memory of the monitor, counted in the memory budget
+        self.streamer = None     # StreamServer sending records to local clients, if enabled
+        self.streamer_id = None
         self.parent = None
 
+    def parse_channel(self, channel):
+        """Split a channel name into (device, channel). Bare names such as ai0 use the action's device."""
+        if "/" in channel:
+            device, name = channel.split("/", 1)
+            return device, name
+        return self.device, channel
+
+    def check_parameters(self):
+        if self.params.rate <= 0 or self.params.samples <= 0:
+            raise ValueError("rate and samples must be positive")
+        if self.params.monitor_decimate < 1 or self.params.monitor_slots < 1:
+            raise ValueError("monitor_decimate and monitor_slots must be at least 1")
+        if self.params.stream:
+            if self.params.stream_queue < 1:
+                raise ValueError("stream_queue must be at least 1")
+            parse_address(self.params.stream_address)
+        if self.params.format == "compressed":
+            if self.params.chunk_samples < 1:
+                raise ValueError("chunk_samples must be at least 1")
+            load_codec(self.params.codec, self.params.compress_level)  # Fails early if the codec is not installed
+
     def setup_daq(self):
-        """Set up the DAQ card task for analog input according to specified parameters."""
+        """Get DAQ tasks for this configuration from the session pool, creating them if there are none."""
+        self.daq_key = ("daq", tuple(self.channel_specs), self.sample_rate, self.num_samples, self.range,
+                        self.params.timestamps)
+        session = sessions.acquire(self.daq_key, self.open_daq, close_daq_tasks)
+        self.tasks, self.task_rows, self.task_blocks, self.readers, self.hardware_timestamps = session
+        self.task = self.tasks[0]
+
+    def open_daq(self):
+        """
+        Set up one DAQ task per device for analog input according to specified parameters.
+
+        The first device listed is the master. Every other task takes its sample clock and start
+        trigger from the master, so all channels are sampled on the same clock edges.
+        """
+        # Imported here so parsing and validating a .con file does not load the NI-DAQmx stack
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+        from nidaqmx.stream_readers import AnalogMultiChannelReader
+
+        devices = []
+        for device, _ in self.channel_specs:
+            if device not in devices:
+                devices.append(device)
+        master = devices[0]
+
         try:
-            self.task = nidaqmx.Task()
-            # Add channels
-            for channel in self.channels:
-                self.task.ai_channels.add_ai_voltage_chan(
-                    f"{self.device}/{channel}",
-                    terminal_config=TerminalConfiguration.DEFAULT,
-                    min_val=-self.range,
-                    max_val=self.range
-                )
-            # Configure timing
-            self.task.timing.cfg_samp_clk_timing(
-                rate=self.sample_rate,
-                sample_mode=AcquisitionType.FINITE,
-                samps_per_chan=self.num_samples
-            )
-            print(f"DAQ task configured with channels: {self.channels}")
+            for device in devices:
+                rows = [i for i, (dev, _) in enumerate(self.channel_specs) if dev == device]
+                task = nidaqmx.Task()
+                self.tasks.append(task)
+                self.task_rows.append(rows)
+                consecutive = rows == list(range(rows[0], rows[-1] + 1))
+                self.task_blocks.append(slice(rows[0], rows[-1] + 1) if consecutive else None)
+                # Add channels
+                for i in rows:
+                    task.ai_channels.add_ai_voltage_chan(
+                        f"{device}/{self.channel_specs[i][1]}",
+                        terminal_config=TerminalConfiguration.DEFAULT,
+                        min_val=-self.range,
+                        max_val=self.range
+                    )
+                # Configure timing, slaves follow the master's sample clock and start trigger
+                if device == master:
+                    task.timing.cfg_samp_clk_timing(
+                        rate=self.sample_rate,
+                        sample_mode=AcquisitionType.FINITE,
+                        samps_per_chan=self.num_samples
+                    )
+                else:
+                    task.timing.cfg_samp_clk_timing(
+                        rate=self.sample_rate,
+                        source=f"/{master}/ai/SampleClock",
+                        sample_mode=AcquisitionType.FINITE,
+                        samps_per_chan=self.num_samples
+                    )
+                    task.triggers.start_trigger.cfg_dig_edge_start_trig(f"/{master}/ai/StartTrigger")
+                if device == master and self.params.timestamps:
+                    try:
+                        task.timing.first_samp_timestamp_enable = True
+                        self.hardware_timestamps = True
+                    except (AttributeError, nidaqmx.DaqError):
+                        print(f"{device} does not support start timestamps, using perf_counter_ns.")
+                self.readers.append(AnalogMultiChannelReader(task.in_stream))
+                print(f"DAQ task on {device} configured with channels: "
+                      f"{[self.channel_specs[i][1] for i in rows]}")
+            if len(self.tasks) > 1:
+                print(f"Devices {devices[1:]} synchronised to master {master}.")
         except nidaqmx.DaqError as e:
             print(f"Error during DAQ setup: {e}")
+            # Not in the session pool yet, so nothing else would close them
+            for task in self.tasks:
+                task.close()
             raise
+        return self.tasks, self.task_rows, self.task_blocks, self.readers, self.hardware_timestamps
 
     def setup(self):
         """Main setup method that configures the DAQ, file handles, and any child actions."""
         super().setup()  # Call the superclass setup first
         
         # Extract relevant parameters
-        self.sample_rate = int(self.parameters.get("rate", self.sample_rate))
-        self.num_samples = int(self.parameters.get("samples", self.num_samples))
-        self.channels    = self.parameters.get("channels", [])
-        self.range       = float(self.parameters.get("range", self.range))
-        self.device      = self.parameters.get("device", self.device)
-        
-        if isinstance(self.channels, str):
-            self.channels = [self.channels]
+        self.sample_rate = self.params.rate
+        self.num_samples = self.params.samples
+        self.channels    = self.params.channels
+        self.range       = self.params.range
+        self.device      = self.params.device
+        self.channel_specs = [self.parse_channel(channel) for channel in self.channels]
+
+        # One time-aligned block for all channels on all devices, reused for every record
+        self.data = budget.allocate(self.path, (len(self.channels), self.num_samples))
         
         # Set up the DAQ card task
         print(f"Setting up A2D with channels {self.channels}, range {self.range} V, "
               f"sample rate {self.sample_rate} Hz, samples {self.num_samples}.")
         self.setup_daq()
 
-        # Create and open files for each channel, using a unique filename
-        for channel in self.channels:
-            filename = f"{self.confile_name}_channel{channel}.bin"
-            if os.path.exists(filename):
-                raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
-            # Open file for writing binary data and store the handle
-            self.data_file_handles.append(open(filename, 'wb'))
-            print(f"Data for channel {channel} will be saved to {filename}.")
-
-        # Call setup on each child action
-        for child_action in self.child_actions:
-            child_action.setup()
-            
+        self.format = self.params.format
+        if self.format == "container":
+            self.container = ContainerWriter.open(f"{self.confile_name}.pyscan")
+            self.stream_id = self.container.add_stream(self, np.float64, (self.num_samples, len(self.channels)),
+                                                       channels=self.channels, rate=self.sample_rate,
+                                                       range=self.range)
+            self.interleaved = budget.allocate(self.path, (self.num_samples, len(self.channels)))
+        elif self.format == "compressed":
+            filename = f"{self.confile_name}_{self.file_tag()}.pyscanz"
+            self.compressed = CompressedWriter(filename, self.channels, self.num_samples,
+                                               chunk_samples=self.params.chunk_samples, codec=self.params.codec,
+                                               level=self.params.compress_level,
+                                               threads=self.params.compress_threads,
+                                               path=self.path, rate=self.sample_rate, range=self.range)
+            print(f"Data will be compressed with {self.params.codec} and saved to {filename}.")
+        elif self.format == "bin":
+            # Create and open files for each channel, using a unique filename
+            for channel in self.channels:
+                filename = f"{self.confile_name}_channel{channel.replace('/', '_')}.bin"
+                if os.path.exists(filename):
+                    raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+                # Open file for writing binary data and store the handle
+                self.data_file_handles.append(open(filename, 'wb'))
+                print(f"Data for channel {channel} will be saved to {filename}.")
+
+        if self.params.timestamps:
+            self.setup_timestamps()
+
+        if self.params.monitor:
+            self.setup_monitor()
+
+        if self.params.stream:
+            self.streamer = StreamServer.open(self.params.stream_address, self.params.stream_queue)
+            self.streamer_id = self.streamer.add_stream(self, np.float64, self.data.shape, channels=self.channels,
+                                                        rate=self.sample_rate, range=self.range)
+
+
+    def setup_timestamps(self):
+        """Open the sidecar file holding the start time and loop indices of every record."""
+        filename = f"{self.confile_name}_{self.file_tag()}_timestamps.bin"
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        self.timestamp_file = open(filename, 'wb')
+        self.timestamp_row = np.zeros(1 + len(self.loop_indices()), dtype=np.int64)
+        self.dead_time = DeadTimeStats(int(self.num_samples * 1e9 / self.sample_rate))
+        print(f"Record start times will be saved to {filename}.")
+
+    def hardware_start_ns(self):
+        """Start time of the latest record from the DAQ, or None if the device cannot tell us."""
+        try:
+            return int(self.task.timing.first_samp_timestamp_val.timestamp() * 1e9)
+        except Exception as e:
+            print(f"Reading the DAQ start timestamp failed: {e}")
+            return None
+
+    def save_timestamp(self, start_ns):
+        """
+        Append the start time of the latest record and its loop indices to the sidecar file.
+
+        start_ns is the perf_counter_ns reading taken when the record was started. The clock is chosen on the first
+        record, DAQ if the device gives a start time then, and every row of the run uses it. If the DAQ start time
+        cannot be read later on, the row gets MISSING_TIMESTAMP rather than a time from another clock.
+        """
+        if self.timestamp_clock is None:
+            hardware_ns = self.hardware_start_ns() if self.hardware_timestamps else None
+            self.timestamp_clock = "perf_counter" if hardware_ns is None else "daq"
+            print(f"Record start times use the {self.timestamp_clock} clock.")
+        elif self.timestamp_clock == "daq":
+            hardware_ns = self.hardware_start_ns()
+        if self.timestamp_clock == "daq":
+            start_ns = MISSING_TIMESTAMP if hardware_ns is None else hardware_ns
+        self.timestamp_row[0] = start_ns
+        self.timestamp_row[1:] = self.loop_indices()
+        self.timestamp_row.tofile(self.timestamp_file)
+        if start_ns == MISSING_TIMESTAMP:
+            self.dead_time.add_missing()
+        else:
+            self.dead_time.add(start_ns)
+
+    def setup_monitor(self):
+        """Create the shared memory ring buffer that live monitors (py_monitor.py) attach to."""
+        name = self.params.monitor_name or f"pyScan_{os.path.basename(self.confile_name)}_{self.file_tag()}"
+        self.monitor_decimate = self.params.monitor_decimate
+        slots = self.params.monitor_slots
+        samples = len(range(0, self.num_samples, self.monitor_decimate))
+        self.monitor_bytes = SharedRingBuffer.size(slots, len(self.channels), samples)
+        budget.claim(f"{self.path} monitor", self.monitor_bytes)
+        try:
+            self.monitor = SharedRingBuffer.create(name, slots, len(self.channels), samples,
+                                                   labels={"channels": self.channels,
+                                                           "rate": self.sample_rate / self.monitor_decimate})
+        except Exception:
+            budget.release(f"{self.path} monitor", self.monitor_bytes)
+            raise
+        print(f"Publishing records to shared memory '{name}' ({slots} slots, decimation {self.monitor_decimate}). "
+              f"Watch with: python py_monitor.py {name}")
+
     def acquire_data2(self):
         """Acquire data from the DAQ card and store it in `self.data`."""
         # Read data from the task
@@ -80,43 +363,43 @@ class A2D(Action):
 
             
     def acquire_data(self):
-        """Acquire data from the DAQ card and store it in `self.data`."""
-        data = None  # Initialize as None; we'll define its structure after the first read
+        """Acquire one record from every DAQ task into the rows of `self.data`."""
+        self.record_timestamp = time.time_ns()
+        # Arm the slaves before the master so they are waiting for its start trigger
+        for task in self.tasks[:0:-1]:
+            task.start()
+        start_ns = time.perf_counter_ns()
+        self.task.start()
+
         total_samples = 0  # Track the total number of samples read
+        try:
+            while total_samples < self.num_samples:
+                # Calculate how many samples are still needed
+                samples_to_read = min(READ_CHUNK, self.num_samples - total_samples)
+                end = total_samples + samples_to_read
 
-        while total_samples < self.num_samples:
-            # Calculate how many samples are still needed
-            samples_to_read = min(10000, self.num_samples - total_samples)
-    
-            try:
-                # Read a chunk of data
-                chunk = self.task.read(number_of_samples_per_channel=samples_to_read, timeout=5)
-                
-                # Initialize the data structure on the first iteration
-                if data is None:
-                    if isinstance(chunk, list):  # Multi-channel data: list of lists
-                        data = [[] for _ in chunk]  # Create one sublist per channel
-                    else:  # Single channel data: a single list
-                        data = []
-    
-                # Append data from the chunk to the appropriate channel
-                if isinstance(chunk, list):  # Multi-channel
-                    for i, ch_data in enumerate(chunk):
-                        data[i].extend(ch_data)
-                else:  # Single channel
-                    data.extend(chunk)
-    
-                total_samples += samples_to_read  # Update the total count of acquired samples
-    
-            except Exception as e:
-                print(f"Error during data acquisition: {e}")
-                break
-    
-        # Convert `data` to a consistent structure (list of lists for multi-channel, single list for single channel)
-        if isinstance(data, list) and isinstance(data[0], list):  # Multi-channel
-            self.data = [np.array(ch, dtype=np.float64) for ch in data]
-        else:  # Single channel
-            self.data = np.array(data, dtype=np.float64)
+                for reader, rows, block in zip(self.readers, self.task_rows, self.task_blocks):
+                    if samples_to_read == self.num_samples and block is not None:
+                        # Whole record from consecutive rows, read straight into the block
+                        reader.read_many_sample(self.data[block],
+                                                number_of_samples_per_channel=samples_to_read, timeout=5)
+                    else:
+                        chunk = np.empty((len(rows), samples_to_read), dtype=np.float64)
+                        reader.read_many_sample(chunk, number_of_samples_per_channel=samples_to_read, timeout=5)
+                        self.data[rows, total_samples:end] = chunk
+
+                total_samples = end  # Update the total count of acquired samples
+
+            if self.timestamp_file is not None:
+                self.save_timestamp(start_ns)
+
+        except Exception as e:
+            # Part of the buffer still holds the previous record, so it must not be saved or published
+            print(f"Error during data acquisition: {e}")
+            raise
+        finally:
+            for task in self.tasks:
+                task.stop()
     
     def print_data(self):
         """Print the mean voltage for each channel from the acquired data."""
@@ -136,21 +419,19 @@ class A2D(Action):
             print("No data available to print.")
 
     def save_data(self):
-        """Write acquired data to the already-open binary file handles."""
-        if self.data is not None:
-            # Handle both single-channel and multi-channel data
-            if isinstance(self.data[0], list) or isinstance(self.data[0], np.ndarray):
-                # Multi-channel data
-                for i, channel_data in enumerate(self.data):
-                    file_handle = self.data_file_handles[i]
-                    # Write data directly to the file handle
-                    np.array(channel_data, dtype=np.float64).tofile(file_handle)
-                    print(f"Data for {self.channels[i]} written to file.")
-            else:
-                # Single-channel data
-                file_handle = self.data_file_handles[0]
-                np.array(self.data, dtype=np.float64).tofile(file_handle)
-                print(f"Data for {self.channels[0]} written to file.")
+        """Write the acquired block to the container, or to the per-channel files one row per channel."""
+        if self.data is not None and self.container is not None:
+            # Transposed so channels are interleaved, written as one block
+            np.copyto(self.interleaved, self.data.T)
+            self.container.write_record(self.stream_id, self.interleaved, self.loop_indices(), self.record_timestamp)
+        elif self.data is not None and self.compressed is not None:
+            # Copied and handed to the compression threads, the next record can be acquired straight away
+            self.compressed.write_record(self.data)
+        elif self.data is not None:
+            for i, channel_data in enumerate(self.data):
+                # Rows of the block are contiguous, so each one is a single write
+                channel_data.tofile(self.data_file_handles[i])
+            print(f"Data for {self.channels} written to file.")
         else:
             print("No data to save.")
 
@@ -159,21 +440,68 @@ class A2D(Action):
         print("Running A2D data acquisition...")
         self.acquire_data()
         self.save_data()
-        if self.parameters.get("print", "false").lower() in ["true", "1", "yes"]:
+        if self.monitor is not None:
+            self.monitor.publish(self.data, self.monitor_decimate)
+        if self.streamer is not None:
+            self.streamer.publish(self.streamer_id, self.data, self.loop_indices(), self.record_timestamp)
+        if self.params.print:
             self.print_data()
         # Run any child actions sequentially after data acquisition
         self.run_children()
 
+    def report_dead_time(self):
+        """Print the dead time between records and store the summary in the run metadata."""
+        summary = self.dead_time.summary()
+        summary["clock"] = self.timestamp_clock
+        summary["missing_timestamp_value"] = int(MISSING_TIMESTAMP)
+        summary["timestamp_columns"] = ["start_ns"] + [f"loop{i}" for i in range(len(self.timestamp_row) - 1)]
+        self.metadata["dead_time"] = summary
+        if "efficiency" in summary:
+            print(f"A2D dead time between records ({summary['clock']} clock): "
+                  f"mean {summary['dead_time_mean_ns'] / 1e6:.3f} ms, "
+                  f"median <= {summary['dead_time_median_ns'] / 1e6:.3f} ms, "
+                  f"p99 <= {summary['dead_time_p99_ns'] / 1e6:.3f} ms, "
+                  f"max {summary['dead_time_max_ns'] / 1e6:.3f} ms, "
+                  f"acquisition efficiency {100 * summary['efficiency']:.1f}%.")
+        if self.dead_time.missing:
+            print(f"A2D start time missing for {self.dead_time.missing} records, "
+                  f"marked {MISSING_TIMESTAMP} in the timestamp file.")
+
     def cleanup(self):
         """Close DAQ resources, file handles, and perform cleanup."""
-        if self.task:
-            self.task.close()  # Close the DAQ task
-            print("DAQ task closed.")
-        
+        if self.tasks:
+            sessions.release(self.daq_key)  # Closes the DAQ tasks unless a batch keeps them for the next file
+            self.tasks = []
+
         # Close all file handles
         for file_handle in self.data_file_handles:
             file_handle.close()
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+        if self.compressed is not None:
+            self.compressed.close()
+            self.compressed = None
+        if self.timestamp_file is not None:
+            self.timestamp_file.close()
+            self.timestamp_file = None
+            self.report_dead_time()
         print("All data files have been closed.")
+        if isinstance(self.data, np.ndarray):
+            budget.free(self.data)
+            budget.free(self.interleaved)
+            self.data = None
+            self.interleaved = None
+
+        if self.monitor is not None:
+            print(f"Monitor: {self.monitor.published} records published, "
+                  f"{self.monitor.reader_drops} dropped by the viewer.")
+            self.monitor.close()
+            self.monitor = None
+            budget.release(f"{self.path} monitor", self.monitor_bytes)
+        if self.streamer is not None:
+            self.streamer.close()
+            self.streamer = None
 
         # Call superclass cleanup
         super().cleanup()
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Runs an action subtree in its own worker process.
+
+Any action can be given `process true` in the .con file. Before setup, the parser replaces such an action with an
+ActorProxy, which starts a worker process, and the worker parses the same .con file and takes over the subtree
+found at the same path. The proxy then forwards setup, run and cleanup over a pipe. Each run command carries the
+loop indices of the enclosing loops, so file names and index files come out the same as in a single process.
+
+A slow NumPy step, camera encode or serial exchange in one device's subtree therefore no longer holds the GIL
+while another device is being driven. If the action at the top of the subtree keeps its latest record in a NumPy
+array `data` (A2D does), the worker copies it into shared memory after every run and the proxy exposes it as
+`data`, so actions in the parent process can read it without anything being pickled.
+
+The run has one memory budget (py_memory.py). Each worker gets an equal share of it, which the parent holds in its
+own budget while the worker runs, and the worker counts its shared memory block against its share.
+
+Workers are started with the spawn method, which is what Windows uses anyway, so behaviour is the same on every
+platform. Ctrl+C is left to the parent, which always sends cleanup so the hardware is released.
+"""
+
+import multiprocessing
+import signal
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from py_common import Action
+from py_memory import budget
+
+
+def find_action(actions, path):
+    """Return the action at `path` in the tree, or None."""
+    for action in actions:
+        if action.path == path:
+            return action
+        found = find_action(action.child_actions, path)
+        if found is not None:
+            return found
+    return None
+
+
+def spawn_actors(actions, confile):
+    """Return `actions` with every subtree marked `process true` replaced by a proxy for a worker process."""
+    replaced = []
+    for action in actions:
+        if action.params is not None and action.params.process:
+            replaced.append(ActorProxy(action, confile))
+        else:
+            action.child_actions = spawn_actors(action.child_actions, confile)
+            replaced.append(action)
+    return replaced
+
+
+def find_proxies(actions):
+    """Every ActorProxy in the tree, i.e. the worker processes started by this process."""
+    proxies = []
+    for action in actions:
+        if isinstance(action, ActorProxy):
+            proxies.append(action)
+        else:
+            proxies.extend(find_proxies(action.child_actions))
+    return proxies
+
+
+def share_budget(actions):
+    """Split this process's memory budget equally between itself and the worker processes it starts."""
+    proxies = find_proxies(actions)
+    if budget.limit is None or not proxies:
+        return
+    share = budget.limit // (len(proxies) + 1)
+    for proxy in proxies:
+        budget.claim(proxy.budget_owner, share)
+        proxy.memory_share = share
+
+
+def ancestors(action):
+    """Enclosing actions, innermost first."""
+    chain = []
+    parent = action.parent
+    while parent is not None:
+        chain.append(parent)
+        parent = parent.parent
+    return chain
+
+
+def serve(confile, path, connection, memory):
+    """Worker process: set up the subtree at `path` of `confile` and run it when told to."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The worker's share of the run's budget, held for it by the parent
+    budget.configure(*memory)
+    from pyScan import ActionParser  # Imported here, pyScan imports this module
+
+    parser = ActionParser(confile)
+    parser.parse()
+    errors = parser.validate()
+    action = find_action(parser.actions, path)
+    if errors or action is None:
+        connection.send(("error", "; ".join(errors) or f"{path} not found in {confile}"))
+        return
+    # Nested subtrees marked 'process true' get processes of their own, and a part of this worker's share
+    action.child_actions = spawn_actors(action.child_actions, confile)
+    share_budget([action])
+    connection.send(("ok", None))
+    enclosing = ancestors(action)
+    shared = None
+
+    while True:
+        command, argument = connection.recv()
+        try:
+            reply = None
+            if command == "setup":
+                action.setup()
+            elif command == "run":
+                for ancestor, loop_index in zip(enclosing, argument):
+                    ancestor.loop_index = loop_index
+                action.run()
+                data = getattr(action, "data", None)
+                if isinstance(data, np.ndarray) and data.nbytes:
+                    if shared is None:
+                        budget.claim(f"{path} shared data", data.nbytes)
+                        shared = shared_memory.SharedMemory(create=True, size=data.nbytes)
+                        reply = {"data": (shared.name, data.shape, data.dtype.str)}
+                    np.ndarray(data.shape, dtype=data.dtype, buffer=shared.buf)[...] = data
+            elif command == "cleanup":
+                action.cleanup()
+                reply = action.metadata_by_path()
+                print(f"Worker process for {path}:", end=" ")
+                budget.report()
+            connection.send(("ok", reply))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+        if command == "cleanup":
+            break
+
+    if shared is not None:
+        shared.close()
+        shared.unlink()
+        budget.release(f"{path} shared data", shared.size)
+    connection.close()
+
+
+class ActorProxy(Action):
+    """Stands in for an action running in a worker process, forwarding setup, run and cleanup to it."""
+
+    def __init__(self, action, confile):
+        super().__init__(action.confile_name)
+        self.remote_class = action.__class__.__name__
+        self.confile = confile
+        self.path = action.path
+        self.parent = action.parent
+        self.line_number = action.line_number
+        self.parameters = action.parameters
+        self.params = action.params
+        self.remote_description = action.describe()
+        self.process = None
+        self.connection = None
+        self.shared = None
+        self.data = None          # Latest record of the remote action, in shared memory
+        self.remote_metadata = {}
+        self.budget_owner = f"{self.path} worker"
+        self.memory_share = None  # Bytes of the parent's budget held for the worker, None without a limit
+
+    def describe(self):
+        return self.remote_description
+
+    def receive(self):
+        """Wait for the worker's reply, raising if the worker reported an error."""
+        try:
+            status, reply = self.connection.recv()
+        except EOFError:
+            raise RuntimeError(f"Worker process for {self.path} exited unexpectedly.")
+        if status == "error":
+            raise RuntimeError(f"{self.path} failed in worker process {self.process.pid}:\n{reply}")
+        return reply
+
+    def request(self, command, argument=None):
+        """Send a command to the worker and wait for its reply."""
+        self.connection.send((command, argument))
+        return self.receive()
+
+    def setup(self):
+        """Start the worker process and set the subtree up in it."""
+        context = multiprocessing.get_context("spawn")
+        self.connection, worker_connection = context.Pipe()
+        memory = (self.memory_share, budget.spill)
+        self.process = context.Process(target=serve, args=(self.confile, self.path, worker_connection, memory),
+                                       name=f"pyScan {self.path}", daemon=True)
+        self.process.start()
+        worker_connection.close()
+        print(f"Started worker process {self.process.pid} for {self.remote_class} at {self.path}.")
+        self.receive()  # The worker has parsed the .con file and found its subtree
+        self.request("setup")
+
+    def run(self):
+        """Run the subtree once in the worker, passing the current loop indices of the enclosing actions."""
+        reply = self.request("run", [ancestor.loop_index for ancestor in ancestors(self)])
+        if reply and "data" in reply:
+            name, shape, dtype = reply["data"]
+            # The worker owns the block and unlinks it. Spawned workers share the parent's resource tracker, so
+            # unlike py_monitor readers there is no registration to undo here.
+            self.shared = shared_memory.SharedMemory(name=name)
+            self.data = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self.shared.buf)
+
+    def cleanup(self):
+        """Clean the subtree up in the worker, collect its metadata and wait for the process to exit."""
+        if self.process is None:
+            self.release_share()
+            return
+        try:
+            if self.process.is_alive():
+                self.remote_metadata = self.request("cleanup") or {}
+        except (RuntimeError, OSError) as e:
+            print(f"Cleanup of {self.path} failed: {e}")
+        finally:
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                print(f"Worker process for {self.path} did not exit, terminating it.")
+                self.process.terminate()
+            self.connection.close()
+            self.process = None
+            self.data = None
+            if self.shared is not None:
+                self.shared.close()
+                self.shared = None
+            self.release_share()
+        print(f"Worker process for {self.path} finished.")
+
+    def release_share(self):
+        """Give the worker's share back to this process's budget once the worker has exited."""
+        if self.memory_share is not None:
+            budget.release(self.budget_owner, self.memory_share)
+            self.memory_share = None
+
+    def metadata_by_path(self):
+        return self.remote_metadata
@@ -1,19 +1,41 @@
 import platform
-import serial
-from py_stage1D import Stage1D
+from py_common import Param
+from py_session import sessions
+from py_stage import Stage1D
+
+
+class SerialConnectionManager:
+    """Serial ports shared by every stage axis on them, through the session pool."""
+
+    @staticmethod
+    def get_connection(port, baudrate=9600, timeout=1):
+        import serial  # Imported here so parsing a .con file does not need pyserial
+
+        def open_port():
+            print(f"Opening serial port {port} at {baudrate} baud.")
+            return serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+
+        return sessions.acquire(("serial", port), open_port, lambda connection: connection.close())
+
+    @staticmethod
+    def close_connection(port):
+        sessions.release(("serial", port))
 
 class AsiScan(Stage1D):
-    def __init__(self, axis_name="X", port=None, baudrate=9600, timeout=1, **kwargs):
+    PARAMETERS = {"port": Param(str)}
+
+    def __init__(self, filebase, port=None, baudrate=9600, timeout=1):
         """
         Initializes the ASI MS-2000 stage as a 1D stage with platform-specific default ports.
+        The axis to control ('X' or 'Y') is given by the axis_name parameter.
         
         Parameters:
-        - axis_name (str): The axis to control ('X' or 'Y').
+        - filebase (str): Base name of the .con file.
         - port (str): Serial port to communicate with the stage (overrides default).
         - baudrate (int): Baud rate for serial communication.
         - timeout (float): Timeout for serial communication in seconds.
         """
-        super().__init__(axis_name=axis_name, **kwargs)
+        super().__init__(filebase)
 
         # Platform-specific default ports
         if port is None:
@@ -38,12 +60,13 @@ class AsiScan(Stage1D):
         Setup method for the ASI MS-2000 stage.
         Establishes the shared serial connection and queries the stage status.
         """
-        super().setup()
+        import serial  # Imported here so parsing a .con file does not need pyserial
 
-        if "port" in self.parameters:
-            port = self.parameters.get("port", None)
-            if port is not None:
-                self.port = port
+        if self.params is None:
+            self.compile_parameters()
+        if self.params.port is not None:
+            self.port = self.params.port
+        self.axis_name = self.params.axis_name
 
         print(f"Setting up ASI MS-2000 {self.axis_name}-Axis Stage on port {self.port}.")
 
@@ -60,13 +83,18 @@ class AsiScan(Stage1D):
         except serial.SerialException as e:
             raise RuntimeError(f"Error communicating with stage: {e}")
 
+        # Parent setup builds the scan grid, which needs the connection to read the current position
+        super().setup()
+
     def cleanup(self):
         """
         Cleanup method for the ASI MS-2000 stage.
         Closes the shared serial connection (if no other actions need it).
         """
-        SerialConnectionManager.close_connection(self.port)
-        super().cleanup()
+        super().cleanup()  # Moves back to the start position for restore, so the connection is still needed
+        if self.serial_connection is not None:
+            SerialConnectionManager.close_connection(self.port)
+            self.serial_connection = None
 
     def go_to(self, point):
         """
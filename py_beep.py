@@ -6,75 +6,150 @@ Created on Thu Dec  5 17:54:38 2024
 @curator: ezzwh
 """
 
+import queue
+import threading
 import time
-from py_common import Action
+from py_common import Action, Param, words
 
-try:
-    import winsound  # Windows sound library
-    PLATFORM = "Windows"
-except ImportError:
-    import simpleaudio as sa  # Cross-platform alternative
-    PLATFORM = "CrossPlatform"
+winsound = None
+sa = None
+PLATFORM = None
 
+TONES = {"beep": 1000, "boop": 600}  # Hz
+TONE_SECONDS = 0.3
+PAUSE_SECONDS = 0.2  # Between sounds
+MAX_QUEUED = 8       # Sequences waiting to be played before new ones are dropped
+tone_cache = {}      # frequency -> simpleaudio WaveObject, synthesised once
+player = None        # SoundPlayer shared by every beep action
 
-class beep(Action):
-    def __init__(self, filebase):
-        super().__init__(filebase)
-        self.sequence = []  # List of tuples (sound_type, count)
 
-    def setup(self):
-        """Parse the parameters to build the beep/boop sequence."""
-        super().setup()
-        for key, value in self.parameters.items():
-            if key.lower() in ["beep", "boop"]:
-                # Handle "once", "twice", and numeric values
-                
-                if value == "once":
-                    count = 1
-                elif value == "twice":
-                    count = 2
-                else:
-                    # Assume the first part of the value is a number
-                    count = int(value[0])  
-                
-                sound_type = key
-                self.sequence.append((sound_type, count))
+def load_sound_backend():
+    """Import the sound library on first use, so parsing a .con file does not load it."""
+    global winsound, sa, PLATFORM
+    if PLATFORM is None:
+        try:
+            import winsound  # Windows sound library
+            PLATFORM = "Windows"
+        except ImportError:
+            import simpleaudio as sa  # Cross-platform alternative
+            PLATFORM = "CrossPlatform"
 
 
-    def run(self):
-        """Play the beep/boop sequence."""
-        super().run()
+def generate_tone(frequency, duration):
+    """Generate a tone using simpleaudio."""
+    import numpy as np
+    sample_rate = 44100  # Samples per second
+    t = np.linspace(0, duration, int(sample_rate * duration), False)
+    tone = np.sin(frequency * t * 2 * np.pi) * 32767  # Sin wave
+    audio_data = tone.astype(np.int16)
+    return sa.WaveObject(audio_data, 1, 2, sample_rate)
+
 
-        for sound_type, count in self.sequence:
-            for _ in range(count):
-                self.play_sound(sound_type)
-                time.sleep(0.2)  # Short pause between sounds
+def get_tone(frequency):
+    """Return the cached tone for a frequency, synthesising it on first use."""
+    if frequency not in tone_cache:
+        tone_cache[frequency] = generate_tone(frequency, TONE_SECONDS)
+    return tone_cache[frequency]
 
-    def play_sound(self, sound_type):
-        """Play a beep or boop sound."""
+
+class SoundPlayer:
+    """Background thread playing queued beep sequences one after the other, in the order they were queued."""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=MAX_QUEUED)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.play_queued, name="beep-player", daemon=True)
+        self.thread.start()
+
+    def play(self, sequence):
+        """Queue a list of (frequency, count) and return straight away."""
+        try:
+            self.queue.put_nowait(sequence)
+        except queue.Full:
+            # Notifications must never hold up the run, so a player that is far behind loses some
+            self.dropped += 1
+
+    def play_queued(self):
+        while True:
+            sequence = self.queue.get()
+            try:
+                for frequency, count in sequence:
+                    for _ in range(count):
+                        self.play_tone(frequency)
+                        time.sleep(PAUSE_SECONDS)  # Short pause between sounds
+            except Exception as e:
+                print(f"Playing sound failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def play_tone(frequency):
         if PLATFORM == "Windows":
-            if sound_type == "beep":
-                winsound.Beep(1000, 300)  # 1000 Hz for 300 ms
-            elif sound_type == "boop":
-                winsound.Beep(600, 300)  # 600 Hz for 300 ms
-        else:  # Cross-platform
-            if sound_type == "beep":
-                frequency = 1000  # 1000 Hz
-            elif sound_type == "boop":
-                frequency = 600  # 600 Hz
+            winsound.Beep(frequency, int(TONE_SECONDS * 1000))
+        else:
+            get_tone(frequency).play().wait_done()
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for the queued sounds to finish playing."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def get_player():
+    global player
+    if player is None:
+        player = SoundPlayer()
+    return player
+
+
+class beep(Action):
+    PARAMETERS = {
+        "beep": Param(words, nargs="+"),
+        "boop": Param(words, nargs="+"),
+    }
+
+    def __init__(self, filebase):
+        super().__init__(filebase)
+        self.sequence = []  # List of tuples (frequency, count)
+
+    def check_parameters(self):
+        """Build the beep/boop sequence in the order the lines appear in the .con file."""
+        self.sequence = []
+        for key, value in self.parameter_lines:
+            if key not in TONES:
+                continue  # Common parameters such as process
+            # Handle "once", "twice", and numeric values such as "3" or "3 times"
+            if value[0] == "once":
+                count = 1
+            elif value[0] == "twice":
+                count = 2
             else:
-                raise ValueError(f"Unknown sound type: {sound_type}")
+                try:
+                    count = int(value[0])
+                except ValueError:
+                    raise ValueError(f"cannot {key} '{' '.join(value)}' times")
+            self.sequence.append((TONES[key], count))
 
-            # Generate tone
-            wave_obj = self.generate_tone(frequency, 0.3)
-            wave_obj.play().wait_done()
+    def setup(self):
+        """Load the sound library and synthesise the tones, the sequence was built when the parameters were compiled."""
+        super().setup()
+        load_sound_backend()
+        if PLATFORM != "Windows":
+            for frequency, _ in self.sequence:
+                get_tone(frequency)
+        get_player()
 
-    @staticmethod
-    def generate_tone(frequency, duration):
-        """Generate a tone using simpleaudio."""
-        import numpy as np
-        sample_rate = 44100  # Samples per second
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        tone = np.sin(frequency * t * 2 * np.pi) * 32767  # Sin wave
-        audio_data = tone.astype(np.int16)
-        return sa.WaveObject(audio_data, 1, 2, sample_rate)
+    def run(self):
+        """Hand the beep/boop sequence to the player thread and carry on without waiting for it."""
+        get_player().play(self.sequence)
+        self.run_children()
+
+    def cleanup(self):
+        """Let queued sounds finish, so a beep at the end of a run is still heard."""
+        if player is not None:
+            pending = sum(count for _, count in self.sequence) * (TONE_SECONDS + PAUSE_SECONDS)
+            player.drain(timeout=max(2.0, MAX_QUEUED * pending))
+            if player.dropped:
+                print(f"{player.dropped} beep sequence(s) were dropped because the player was busy.")
+        super().cleanup()
@@ -1,15 +1,173 @@
 """
-Some common methods used by pyScan. Currently just the Action superclass.
+Some common methods used by pyScan: the Action superclass and its parameter declarations, precise timing and a
+small on-disk cache.
 """
 
+import json
+import os
+import time
+
+SPIN_NS = 1_000_000  # Busy-wait for the last millisecond before a deadline, time.sleep is not that accurate
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyScan")
+DISCOVERY_MAX_AGE = 300  # Seconds a device enumeration is reused for
+
+
+def cached_discovery(name, discover, max_age=DISCOVERY_MAX_AGE, refresh=False):
+    """
+    Return the result of discover(), reusing the one saved by a previous run if it is less than max_age seconds old.
+
+    Device enumeration through vendor libraries can take seconds, while the connected hardware rarely changes
+    between runs. The result must be JSON serialisable. Use refresh=True to force a new enumeration, e.g. when a
+    device from the cached list could not be found.
+    """
+    filename = os.path.join(CACHE_DIR, f"{name}.json")
+    if not refresh:
+        try:
+            if time.time() - os.path.getmtime(filename) < max_age:
+                with open(filename, "r") as file:
+                    return json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    result = discover()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(filename, "w") as file:
+            json.dump(result, file)
+    except (OSError, TypeError) as e:
+        print(f"Could not cache {name}: {e}")
+    return result
+
+
+def sleep_until(deadline_ns, spin_ns=SPIN_NS):
+    """
+    Wait until time.monotonic_ns() reaches deadline_ns.
+
+    Sleeps while more than spin_ns remain, then spins for the rest, giving sub-millisecond accuracy without
+    burning a core for the whole wait.
+    """
+    while True:
+        remaining = deadline_ns - time.monotonic_ns()
+        if remaining <= 0:
+            return
+        if remaining > spin_ns:
+            time.sleep((remaining - spin_ns) / 1e9)
+
+
+def boolean(word):
+    """Convert true/false style words from a .con file."""
+    if word.lower() in ["true", "1", "yes", "on"]:
+        return True
+    if word.lower() in ["false", "0", "no", "off"]:
+        return False
+    raise ValueError(f"expected true or false, got '{word}'")
+
+
+def words(values):
+    """Keep a multi-word parameter as a list of strings."""
+    return list(values)
+
+
+def floats(values):
+    return [float(value) for value in values]
+
+
+def ints(values):
+    return [int(value) for value in values]
+
+
+class Param:
+    """
+    Declaration of one action parameter.
+
+    nargs is the number of words after the key: 0 for a flag that is True when present, 1 for a single value
+    passed to convert, "?" for an optional single value (True when the key is given alone), an integer n for exactly
+    n words or "+" for one or more words, passed to convert as a list.
+    choices restricts a single value to a set of (lower case) words.
+    """
+
+    def __init__(self, convert=str, default=None, nargs=1, required=False, choices=None):
+        self.convert = convert
+        self.default = default
+        self.nargs = nargs
+        self.required = required
+        self.choices = choices
+
+    def compile(self, name, value):
+        """Convert the raw value stored by parse_line, raising ValueError with a readable message."""
+        if value is None:
+            if self.required:
+                raise ValueError(f"missing required parameter '{name}'")
+            return False if self.nargs == 0 else self.default
+        values = [value] if isinstance(value, str) else list(value)
+
+        if self.nargs == 0:
+            if values:
+                raise ValueError(f"'{name}' is a flag and takes no value")
+            return True
+        if self.nargs == "?":
+            if not values:
+                return True
+            if len(values) > 1:
+                raise ValueError(f"'{name}' takes at most one value, got {len(values)}")
+        if self.nargs == "+" and not values:
+            raise ValueError(f"'{name}' needs at least one value")
+        if isinstance(self.nargs, int) and len(values) != self.nargs:
+            raise ValueError(f"'{name}' takes {self.nargs} value(s), got {len(values)}")
+
+        try:
+            if self.nargs in (1, "?"):
+                converted = self.convert(values[0])
+            else:
+                converted = self.convert(values)
+        except ValueError as e:
+            raise ValueError(f"invalid value for '{name}': {e}")
+        if self.choices is not None:
+            converted = converted.lower()
+            if converted not in self.choices:
+                raise ValueError(f"'{name}' must be one of {self.choices}, got '{converted}'")
+        return converted
+
+
+class Parameters:
+    """Base of the compiled parameter objects, one __slots__ subclass is made per action class."""
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{self.__class__.__name__}({values})"
+
+
 class Action:
+    # Parameters understood by the action, name -> Param. Merged with those declared by parent classes.
+    # process: run this action and its children in a worker process of their own (see py_actor.py)
+    PARAMETERS = {
+        "process": Param(boolean, False),
+    }
+
     def __init__(self, confile_name=""):
         self.confile_name = confile_name  # Store the name of the .con file
         # Dictionary to store parsed parameters from configuration lines
         self.parameters = {}
+        # The same lines as (key, values) in file order, for actions where order or repeats matter
+        self.parameter_lines = []
+        # Typed parameters compiled from self.parameters by compile_parameters
+        self.params = None
+        # Line of the .con file declaring this action, set by the parser
+        self.line_number = 0
         # List to hold child actions, for nested configurations
         self.child_actions = []
         self.parent = None
+        # Current iteration of this action if it loops over its children (count, scans), None otherwise
+        self.loop_index = None
+        # Position in the action tree, e.g. count[0]/A2D[0], set by the parser
+        self.path = self.__class__.__name__
+        # Run metadata (timing statistics etc.) saved to <confile>_metadata.json at the end of the run
+        self.metadata = {}
 
     def parse_line(self, words):
         """Parse a line from the config file, storing key-value pairs in the parameters dictionary."""
@@ -20,14 +178,91 @@ class Action:
         value = words[1:]  # Everything after the key is treated as a list of values
         # Store the value in the dictionary, as a list if multiple items, or a single value otherwise
         self.parameters[key] = value[0] if len(value) == 1 else value
+        self.parameter_lines.append((key, value))
+
+    @classmethod
+    def parameter_schema(cls):
+        """Return the declared parameters of this action class and its parents."""
+        schema = {}
+        for klass in reversed(cls.__mro__):
+            schema.update(getattr(klass, "PARAMETERS", {}))
+        return schema
+
+    @classmethod
+    def parameters_class(cls):
+        """Return the __slots__ class holding this action's compiled parameters, made once per action class."""
+        if "_parameters_class" not in cls.__dict__:
+            cls._parameters_class = type(f"{cls.__name__}Parameters", (Parameters,),
+                                         {"__slots__": tuple(cls.parameter_schema())})
+        return cls._parameters_class
+
+    def compile_parameters(self):
+        """
+        Convert the raw strings from the .con file into typed attributes of self.params.
+
+        Called once after parsing, before any hardware is opened. Raises ValueError describing every problem.
+        """
+        schema = self.parameter_schema()
+        problems = [f"unknown parameter '{key}'" for key in self.parameters if key not in schema]
+        values = {}
+        for name, param in schema.items():
+            try:
+                values[name] = param.compile(name, self.parameters.get(name))
+            except ValueError as e:
+                problems.append(str(e))
+        if not problems:
+            self.params = self.parameters_class()(**values)
+            try:
+                self.check_parameters()
+            except ValueError as e:
+                problems.append(str(e))
+        if problems:
+            self.params = None
+            raise ValueError("; ".join(problems))
+
+    def check_parameters(self):
+        """Check combinations of compiled parameters, raising ValueError. Override where needed."""
+        pass
 
     def add_child_action(self, action):
         """Add a child action to be managed and executed in sequence."""
         self.child_actions.append(action)
 
+    def describe(self):
+        """Return this action and its children as plain data, e.g. for saving alongside the results."""
+        return {"action": self.__class__.__name__, "path": self.path, "parameters": self.parameters,
+                "children": [child_action.describe() for child_action in self.child_actions]}
+
+    def metadata_by_path(self):
+        """Return the run metadata of this action and its children, keyed by action path."""
+        metadata = {self.path: self.metadata} if self.metadata else {}
+        for child_action in self.child_actions:
+            metadata.update(child_action.metadata_by_path())
+        return metadata
+
+    def file_tag(self):
+        """Return the action path in a form usable in file names, e.g. count0_A2D0."""
+        return self.path.replace("[", "").replace("]", "").replace("/", "_")
+
+    def iterations(self):
+        """Number of times one run of this action runs its children, known once the parameters are compiled."""
+        return 1
+
+    def loop_indices(self):
+        """Return the current iteration index of every enclosing loop action, outermost first."""
+        indices = []
+        action = self.parent
+        while action is not None:
+            if action.loop_index is not None:
+                indices.append(action.loop_index)
+            action = action.parent
+        return indices[::-1]
+
     def setup(self):
         """Setup resources for this action and all child actions."""
         print(f"Setting up action: {self.__class__.__name__}")
+        if self.params is None:
+            self.compile_parameters()
         
         # Setup all child actions recursively
         for child_action in self.child_actions:
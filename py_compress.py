@@ -0,0 +1,257 @@
+"""
+Chunked, compressed storage for A2D records.
+
+Every record of every channel is cut into chunks of at most `chunk_samples` samples. Each chunk is byte-shuffled
+(all first bytes of the samples, then all second bytes, ...), which turns slowly varying float64 signals into long
+runs of near-identical bytes, and then compressed with zlib, lz4 or zstd. Compression runs on a thread pool, the
+codecs release the GIL so the chunks of one record are compressed on several cores while the next record is
+acquired. Chunks are written in order and located through an offset table, so any record or channel can be read
+back without decompressing the rest of the file.
+
+Layout:
+    header      64 bytes: magic, version, flags, metadata length, table offset and chunk count (see HEADER)
+    metadata    JSON: dtype, channels, samples per record, chunk size, codec
+    chunks      compressed chunks in the order they were written, each preceded by its TABLE_DTYPE row
+    table       one TABLE_DTYPE row per chunk: record, channel, first sample, offset and length
+
+The header is written with the UNFINISHED flag when the file is opened and completed by close(). Chunks are flushed
+every FLUSH_CHUNKS chunks. If a run is killed, CompressedReader rebuilds the table from the rows in front of the
+chunks, so everything written up to then can still be read.
+
+Reading back:
+    reader = CompressedReader("scan_count0_A2D0.pyscanz")
+    record = reader.read(12)               # (channels, samples) array
+    trace = reader.read(12, channel=1)     # (samples,) array
+"""
+
+import collections
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from py_memory import budget
+
+MAGIC = b"PYSCANZ1"
+VERSION = 2  # 1 had no table row in front of each chunk
+UNFINISHED = 1  # Header flag: the file was not closed, the table has to be rebuilt from the chunk rows
+FLUSH_CHUNKS = 256
+HEADER = struct.Struct("<8sII3Q")  # magic, version, flags, metadata length, table offset, chunk count
+HEADER_SIZE = 64
+TABLE_DTYPE = np.dtype([
+    ("record", "<u8"),
+    ("channel", "<u4"),
+    ("start", "<u8"),
+    ("offset", "<u8"),
+    ("length", "<u8"),
+])
+CODECS = ["zlib", "lz4", "zstd"]
+DEFAULT_LEVEL = {"zlib": 1, "lz4": 0, "zstd": 3}
+
+
+def load_codec(name, level=None):
+    """Return (compress, decompress) functions for a codec, importing optional packages only when asked for."""
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec '{name}', use one of {CODECS}.")
+    if level is None:
+        level = DEFAULT_LEVEL[name]
+    if name == "zlib":
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if name == "lz4":
+        try:
+            import lz4.block
+        except ImportError:
+            raise ImportError("codec lz4 needs the lz4 package (pip install lz4)")
+        return (lambda data: lz4.block.compress(data, compression=level)), lz4.block.decompress
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("codec zstd needs the zstandard package (pip install zstandard)")
+        # Compressor objects are not thread safe, so each call makes its own
+        return (lambda data: zstandard.ZstdCompressor(level=level).compress(data)), \
+            (lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def shuffle(samples):
+    """Byte-shuffle a 1-D array: byte 0 of every sample, then byte 1 of every sample, and so on."""
+    return samples.view(np.uint8).reshape(len(samples), samples.itemsize).T.tobytes()
+
+
+def unshuffle(data, dtype):
+    """Invert shuffle, returning a 1-D array of dtype."""
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1).T.copy().view(dtype).ravel()
+
+
+class CompressedWriter:
+    """Appends (channels, samples) records to a chunked, compressed file using a pool of compression threads."""
+
+    def __init__(self, filename, channels, samples, dtype=np.float64, chunk_samples=16384, codec="zlib",
+                 level=None, threads=None, **info):
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        self.filename = filename
+        self.channels = channels
+        self.samples = samples
+        self.dtype = np.dtype(dtype)
+        self.chunk_samples = min(chunk_samples, samples)
+        self.compress, _ = load_codec(codec, level)
+        self.pool = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1,
+                                       thread_name_prefix="compress")
+        # Bound the backlog so a codec slower than the acquisition cannot take all the memory. Queued records are also
+        # counted against the run's memory budget.
+        self.owner = info.get("path", os.path.basename(filename))
+        self.max_pending = 4 * self.pool._max_workers * max(1, len(channels) * -(-samples // self.chunk_samples))
+        # (record, channel, start, reserved bytes, future, spilled buffer) in file order
+        self.pending = collections.deque()
+        self.records = 0
+        self.raw_bytes = 0
+        self.position = 0
+        self.table = np.zeros(1024, dtype=TABLE_DTYPE)
+        self.count = 0
+
+        self.file = open(filename, "wb")
+        metadata = json.dumps(dict(version=VERSION, dtype=self.dtype.str, channels=list(channels), samples=samples,
+                                   chunk_samples=self.chunk_samples, codec=codec,
+                                   level=DEFAULT_LEVEL[codec] if level is None else level, shuffle=True, **info),
+                              indent=1).encode()
+        self.metadata_length = len(metadata)
+        self.file.write(HEADER.pack(MAGIC, VERSION, UNFINISHED, self.metadata_length, 0, 0).ljust(HEADER_SIZE, b"\0"))
+        self.file.write(metadata)
+        self.file.flush()
+        self.position = HEADER_SIZE + len(metadata)
+
+    def compress_chunk(self, samples):
+        return self.compress(shuffle(samples))
+
+    def write_record(self, record):
+        """Queue one (channels, samples) record for compression. The record is copied, so it may be reused."""
+        nbytes = np.asarray(record).size * self.dtype.itemsize
+        spilled = None
+        if budget.spill and budget.limit is not None and nbytes > budget.limit:
+            spilled = budget.allocate(self.owner, np.shape(record), self.dtype)  # Could never be reserved
+        # Hold the producer back while the budget is full, writing out our own finished chunks to make room
+        while spilled is None and not budget.reserve(self.owner, nbytes, timeout=0):
+            if self.pending:
+                self.pending[0][4].result()
+                self.drain()
+            elif budget.spill:
+                # Nothing of ours left to wait for, queue the copy on disk instead
+                spilled = budget.allocate(self.owner, np.shape(record), self.dtype)
+                break
+            else:
+                raise MemoryError(f"No room in the memory budget to queue a record of {self.owner} for compression "
+                                  f"(in use: {budget.describe_usage()}).")
+        if spilled is None:
+            record = np.array(record, dtype=self.dtype)
+        else:
+            spilled[...] = record
+            record, nbytes = spilled, 0
+        for channel in range(len(record)):
+            for start in range(0, self.samples, self.chunk_samples):
+                chunk = record[channel, start:start + self.chunk_samples]
+                future = self.pool.submit(self.compress_chunk, chunk)
+                self.pending.append((self.records, channel, start, chunk.nbytes if nbytes else 0, future, None))
+        if spilled is not None:
+            # Given back once its last chunk is written
+            self.pending[-1] = self.pending[-1][:5] + (spilled,)
+        self.records += 1
+        self.raw_bytes += record.nbytes
+        self.drain(wait=len(self.pending) > self.max_pending)
+
+    def drain(self, wait=False):
+        """Write finished chunks in order. With wait, block until the backlog is back under its limit."""
+        while self.pending and (self.pending[0][4].done() or (wait and len(self.pending) > self.max_pending // 2)):
+            record, channel, start, nbytes, future, spilled = self.pending.popleft()
+            payload = future.result()
+            if nbytes:
+                budget.release(self.owner, nbytes)
+            budget.free(spilled)
+            if self.count == len(self.table):
+                self.table = np.concatenate([self.table, np.zeros(len(self.table), dtype=TABLE_DTYPE)])
+            self.table[self.count] = (record, channel, start, self.position + TABLE_DTYPE.itemsize, len(payload))
+            self.file.write(self.table[self.count:self.count + 1].tobytes())
+            self.file.write(payload)
+            self.position += TABLE_DTYPE.itemsize + len(payload)
+            self.count += 1
+            if self.count % FLUSH_CHUNKS == 0:
+                self.file.flush()
+
+    def close(self):
+        """Write the remaining chunks, the offset table and the final header."""
+        while self.pending:
+            self.pending[0][4].result()
+            self.drain()
+        self.pool.shutdown()
+        table_offset = self.position
+        self.file.write(self.table[:self.count].tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, self.metadata_length, table_offset, self.count))
+        self.file.close()
+        ratio = self.raw_bytes / self.position if self.position else 0.0
+        print(f"Compressed file {self.filename} closed with {self.records} records, ratio {ratio:.2f}.")
+
+
+class CompressedReader:
+    """Random access to the records of a file written by CompressedWriter."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            magic, version, flags, metadata_length, table_offset, count = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a pyScan compressed file.")
+            if version > VERSION:
+                raise ValueError(f"{filename} is version {version}, this reader handles {VERSION}.")
+            file.seek(HEADER_SIZE)
+            self.metadata = json.loads(file.read(metadata_length))
+        self.dtype = np.dtype(self.metadata["dtype"])
+        self.channels = self.metadata["channels"]
+        self.samples = self.metadata["samples"]
+        _, self.decompress = load_codec(self.metadata["codec"])
+        if flags & UNFINISHED:
+            self.table = self.recover(HEADER_SIZE + metadata_length)
+            print(f"{filename} was not closed, recovered {len(self.table)} chunks of complete records.")
+        else:
+            self.table = np.fromfile(filename, dtype=TABLE_DTYPE, count=count, offset=table_offset)
+        self.records = int(self.table["record"].max()) + 1 if len(self.table) else 0
+
+    def recover(self, position):
+        """Rebuild the table of an unfinished file from the rows in front of the chunks, up to the first gap."""
+        size = os.path.getsize(self.filename)
+        rows = []
+        with open(self.filename, "rb") as file:
+            while position + TABLE_DTYPE.itemsize <= size:
+                file.seek(position)
+                row = np.frombuffer(file.read(TABLE_DTYPE.itemsize), dtype=TABLE_DTYPE)[0]
+                end = int(row["offset"]) + int(row["length"])
+                if (row["offset"] != position + TABLE_DTYPE.itemsize or row["channel"] >= len(self.channels)
+                        or row["start"] >= self.samples or end > size):
+                    break  # Not written, or cut off by the crash
+                rows.append(row)
+                position = end
+        table = np.array(rows, dtype=TABLE_DTYPE)
+        # Chunks are written in record order, so only the last record can be incomplete
+        per_record = len(self.channels) * -(-self.samples // self.metadata["chunk_samples"])
+        if len(table) and (table["record"] == table["record"][-1]).sum() < per_record:
+            table = table[table["record"] != table["record"][-1]]
+        return table
+
+    def read(self, record, channel=None):
+        """Return one record as (channels, samples), or a single channel of it as (samples,)."""
+        rows = self.table[self.table["record"] == record]
+        if channel is not None:
+            rows = rows[rows["channel"] == channel]
+        if not len(rows):
+            raise KeyError(f"No record {record} in {self.filename}.")
+        out = np.empty((len(self.channels), self.samples), dtype=self.dtype)
+        with open(self.filename, "rb") as file:
+            for row in rows:
+                file.seek(int(row["offset"]))
+                chunk = unshuffle(self.decompress(file.read(int(row["length"]))), self.dtype)
+                out[row["channel"], row["start"]:row["start"] + len(chunk)] = chunk
+        return out if channel is None else out[channel]
@@ -0,0 +1,223 @@
+"""
+Single-file container for pyScan data, an alternative to one headerless .bin file per channel.
+
+Layout:
+    header      64 bytes: magic, version, then offsets and sizes of the other sections (see HEADER)
+    metadata    JSON: the parsed action tree and one entry per data stream (path, dtype, shape, channels, rate)
+    records     one block per record: its INDEX_DTYPE row, then the record itself, each starting on an ALIGNMENT
+                boundary. A2D records are stored as (samples, channels), i.e. channels interleaved sample by sample
+    index       one INDEX_DTYPE row per record: stream, loop indices, offset, length and timestamp
+
+The header and metadata are written before the first record, with the UNFINISHED flag set. The index is written
+and the flag cleared when the file is closed. Records are flushed to the operating system every FLUSH_RECORDS
+records, so if a run is killed or crashes, ContainerReader rebuilds the index by walking the record blocks and
+everything written up to then can still be read. Several actions writing to the same file share one
+ContainerWriter.
+
+Reading back:
+    reader = ContainerReader("scan.pyscan")
+    record = reader.read("count[0]/A2D[0]", [12])   # memory-mapped (samples, channels) array
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"PYSCANC1"
+VERSION = 2  # 1 had no index row in front of each record
+UNFINISHED = 1  # Header flag: the file was not closed, the index has to be rebuilt from the record blocks
+FLUSH_RECORDS = 64
+HEADER = struct.Struct("<8sII5Q")  # magic, version, flags, metadata offset/length, data offset, index offset/count
+HEADER_SIZE = 64
+ALIGNMENT = 64  # cache line, keeps every record aligned for memory-mapped access
+MAX_LOOP_DEPTH = 8
+INDEX_DTYPE = np.dtype([
+    ("stream", "<u4"),
+    ("depth", "<u4"),
+    ("loop", "<i8", (MAX_LOOP_DEPTH,)),
+    ("offset", "<u8"),
+    ("length", "<u8"),
+    ("timestamp_ns", "<i8"),
+])
+ENTRY_SPACE = -(-INDEX_DTYPE.itemsize // ALIGNMENT) * ALIGNMENT  # Room for the row in front of each record
+
+
+def aligned(offset):
+    """Round an offset up to the next ALIGNMENT boundary."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class ContainerWriter:
+    """Writes records from one or more actions into a single container file."""
+
+    open_writers = {}  # filename -> shared writer
+
+    def __init__(self, filename):
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.users = 0
+        self.trees = {}    # root path -> description of the action tree
+        self.streams = []  # metadata for each stream, the position is the stream id
+        self.started = False
+        self.position = 0
+        self.index = np.zeros(1024, dtype=INDEX_DTYPE)
+        self.count = 0
+
+    @classmethod
+    def open(cls, filename):
+        """Return the writer for `filename`, creating it on first use."""
+        writer = cls.open_writers.get(filename)
+        if writer is None:
+            writer = cls(filename)
+            cls.open_writers[filename] = writer
+            print(f"Data will be saved to container {filename}.")
+        writer.users += 1
+        return writer
+
+    def add_stream(self, action, dtype, shape, **info):
+        """Register a stream of fixed-shape records from `action`, returning its stream id."""
+        if self.started:
+            raise RuntimeError(f"Cannot add a stream to {self.filename} after records have been written.")
+        depth = len(action.loop_indices())
+        if depth > MAX_LOOP_DEPTH:
+            raise ValueError(f"{action.path} is nested in {depth} loops, the container supports {MAX_LOOP_DEPTH}.")
+        root = action
+        while root.parent is not None:
+            root = root.parent
+        self.trees[root.path] = root.describe()
+        self.streams.append(dict(path=action.path, dtype=np.dtype(dtype).str, shape=list(shape),
+                                 loop_depth=depth, **info))
+        return len(self.streams) - 1
+
+    def start(self):
+        """Write the header and metadata, so the data section can begin."""
+        metadata = json.dumps({"version": VERSION, "alignment": ALIGNMENT,
+                               "trees": list(self.trees.values()), "streams": self.streams}, indent=1).encode()
+        self.metadata_length = len(metadata)
+        self.data_offset = aligned(HEADER_SIZE + len(metadata))
+        self.file.write(HEADER.pack(MAGIC, VERSION, UNFINISHED, HEADER_SIZE, self.metadata_length,
+                                    self.data_offset, 0, 0).ljust(HEADER_SIZE, b"\0"))
+        self.file.write(metadata)
+        self.position = HEADER_SIZE + len(metadata)
+        self.pad_to(self.data_offset)
+        self.file.flush()
+        self.started = True
+
+    def pad_to(self, offset):
+        if offset > self.position:
+            self.file.write(b"\0" * (offset - self.position))
+            self.position = offset
+
+    def write_record(self, stream, record, loop_indices, timestamp_ns):
+        """Append one record, preceded by its index row, and index it."""
+        if not self.started:
+            self.start()
+        if self.count == len(self.index):
+            self.index = np.concatenate([self.index, np.zeros(len(self.index), dtype=INDEX_DTYPE)])
+
+        record = np.ascontiguousarray(record)
+        entry = self.index[self.count]
+        entry["stream"] = stream
+        entry["depth"] = len(loop_indices)
+        entry["loop"][:len(loop_indices)] = loop_indices
+        entry["offset"] = self.position + ENTRY_SPACE
+        entry["length"] = record.nbytes
+        entry["timestamp_ns"] = timestamp_ns
+        self.count += 1
+
+        self.file.write(self.index[self.count - 1:self.count].tobytes().ljust(ENTRY_SPACE, b"\0"))
+        self.file.write(memoryview(record).cast("B"))
+        self.position += ENTRY_SPACE + record.nbytes
+        self.pad_to(aligned(self.position))
+        if self.count % FLUSH_RECORDS == 0:
+            self.file.flush()
+
+    def close(self):
+        """Release one user. The last one writes the index and header and closes the file."""
+        self.users -= 1
+        if self.users > 0:
+            return
+        if not self.started:
+            self.start()
+        index_offset = self.position
+        self.file.write(self.index[:self.count].tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, HEADER_SIZE, self.metadata_length,
+                                    self.data_offset, index_offset, self.count))
+        self.file.close()
+        del ContainerWriter.open_writers[self.filename]
+        print(f"Container {self.filename} closed with {self.count} records.")
+
+
+class ContainerReader:
+    """Random access to the records of a container file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            magic, version, flags, metadata_offset, metadata_length, self.data_offset, index_offset, count = \
+                HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a pyScan container.")
+            if version > VERSION:
+                raise ValueError(f"{filename} is container version {version}, this reader handles {VERSION}.")
+            file.seek(metadata_offset)
+            self.metadata = json.loads(file.read(metadata_length))
+        self.streams = self.metadata["streams"]
+        self.stream_ids = {stream["path"]: i for i, stream in enumerate(self.streams)}
+        if flags & UNFINISHED:
+            self.index = self.recover()
+            print(f"{filename} was not closed, recovered {len(self.index)} complete records.")
+        elif count:
+            self.index = np.memmap(filename, dtype=INDEX_DTYPE, mode="r", offset=index_offset, shape=(count,))
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.lookup = None
+
+    def recover(self):
+        """Rebuild the index of an unfinished file from the rows in front of the records, up to the first gap."""
+        size = os.path.getsize(self.filename)
+        lengths = [int(np.prod(stream["shape"])) * np.dtype(stream["dtype"]).itemsize for stream in self.streams]
+        entries = []
+        position = self.data_offset
+        with open(self.filename, "rb") as file:
+            while position + ENTRY_SPACE <= size:
+                file.seek(position)
+                entry = np.frombuffer(file.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+                end = int(entry["offset"]) + int(entry["length"])
+                if (entry["offset"] != position + ENTRY_SPACE or entry["stream"] >= len(self.streams)
+                        or entry["length"] != lengths[entry["stream"]] or end > size):
+                    break  # Not written, or cut off by the crash
+                entries.append(entry)
+                position = aligned(end)
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def build_lookup(self):
+        """Map (stream, loop indices) to the row of the index."""
+        self.lookup = {}
+        for row, entry in enumerate(self.index):
+            key = (int(entry["stream"]),) + tuple(int(i) for i in entry["loop"][:entry["depth"]])
+            self.lookup[key] = row
+
+    def entries(self, path):
+        """Index rows belonging to the stream of action `path`, in the order they were written."""
+        return self.index[self.index["stream"] == self.stream_ids[path]]
+
+    def record(self, entry):
+        """Memory-map the record described by one index row."""
+        stream = self.streams[entry["stream"]]
+        return np.memmap(self.filename, dtype=np.dtype(stream["dtype"]), mode="r",
+                         offset=int(entry["offset"]), shape=tuple(stream["shape"]))
+
+    def read(self, path, loop_indices):
+        """Return the record written by action `path` at the given loop indices."""
+        if self.lookup is None:
+            self.build_lookup()
+        key = (self.stream_ids[path],) + tuple(loop_indices)
+        if key not in self.lookup:
+            raise KeyError(f"No record from {path} at loop indices {list(loop_indices)}.")
+        return self.record(self.index[self.lookup[key]])
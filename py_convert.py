@@ -0,0 +1,195 @@
+"""
+Offline processing of A2D runs saved in the per-channel .bin format.
+
+The .con file gives the channels and samples per record; the number of records comes from the file sizes, so
+partial (aborted) runs work too. Records are split into ranges which a pool of worker processes reads through
+np.memmap, a block at a time, so memory stays bounded whatever the size of the run and the work spreads over all
+cores.
+
+Operations (several can be given at once, the input is read only once):
+    stats    per-record mean, std, min and max of every channel -> <base>_<tag>_stats.npy, (records, channels, 4)
+    average  average record of every channel                    -> <base>_<tag>_average.npy, (channels, samples)
+    psd      averaged one-sided power spectral density (Hann)   -> <base>_<tag>_psd.npz, freqs and (channels, freqs)
+    repack   records as (records, samples, channels), float32 by default -> <base>_<tag>_repack.npy
+
+Existing outputs are never replaced unless --force is given.
+
+Usage:
+    python py_convert.py <confile> --op stats average psd [--workers 8] [--block-mb 64] [--force]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from pyScan import ActionParser
+from py_a2d import A2D
+
+OPERATIONS = ["stats", "average", "psd", "repack"]
+SUFFIXES = {"stats": "_stats.npy", "average": "_average.npy", "psd": "_psd.npz", "repack": "_repack.npy"}
+
+
+def find_a2d_actions(actions):
+    """Yield every A2D action in the tree, depth first."""
+    for action in actions:
+        if isinstance(action, A2D):
+            yield action
+        yield from find_a2d_actions(action.child_actions)
+
+
+def expected_records(action):
+    """Number of records the loops around `action` would produce in a complete run."""
+    records = 1
+    parent = action.parent
+    while parent is not None:
+        records *= parent.iterations()
+        parent = parent.parent
+    return records
+
+
+def process_range(job):
+    """
+    Worker: process records [start, stop) of one A2D run, a block at a time.
+
+    Per-record outputs (stats, repack) are written straight into their memory-mapped output files. Sums for the
+    averaged outputs are returned to the parent.
+    """
+    files, records, samples, start, stop, block_records, operations, outputs, rate = job
+    inputs = [np.memmap(filename, dtype=np.float64, mode="r", shape=(records, samples)) for filename in files]
+    stats = np.load(outputs["stats"], mmap_mode="r+") if "stats" in operations else None
+    repack = np.load(outputs["repack"], mmap_mode="r+") if "repack" in operations else None
+    window = np.hanning(samples) if "psd" in operations else None
+    sums = {}
+
+    for first in range(start, stop, block_records):
+        last = min(first + block_records, stop)
+        block = np.stack([channel[first:last] for channel in inputs], axis=1)  # (records, channels, samples)
+
+        if stats is not None:
+            stats[first:last, :, 0] = block.mean(axis=2)
+            stats[first:last, :, 1] = block.std(axis=2)
+            stats[first:last, :, 2] = block.min(axis=2)
+            stats[first:last, :, 3] = block.max(axis=2)
+        if repack is not None:
+            repack[first:last] = block.transpose(0, 2, 1)
+        if "average" in operations:
+            sums["average"] = sums.get("average", 0) + block.sum(axis=0)
+        if "psd" in operations:
+            detrended = (block - block.mean(axis=2, keepdims=True)) * window
+            power = np.abs(np.fft.rfft(detrended, axis=2)) ** 2
+            sums["psd"] = sums.get("psd", 0) + power.sum(axis=0)
+
+    for output in (stats, repack):
+        if output is not None:
+            output.flush()
+    return stop - start, sums
+
+
+def output_names(action, operations):
+    """Output file of each operation for one A2D action."""
+    base = f"{action.confile_name}_{action.file_tag()}"
+    return {operation: base + SUFFIXES[operation] for operation in operations}
+
+
+def convert(action, operations, workers=None, block_mb=64, repack_dtype="float32", force=False):
+    """
+    Run the requested operations over the .bin files of one A2D action using a process pool.
+
+    Raises FileExistsError before reading anything if an output exists, unless force is set.
+    """
+    params = action.params
+    names = output_names(action, operations)
+    if not force:
+        for filename in names.values():
+            if os.path.exists(filename):
+                raise FileExistsError(f"File {filename} already exists. Please remove it or use --force.")
+    files = [f"{action.confile_name}_channel{channel.replace('/', '_')}.bin" for channel in params.channels]
+    record_bytes = params.samples * 8
+    counts = [os.path.getsize(filename) // record_bytes for filename in files]
+    records = min(counts)
+    if len(set(counts)) > 1:
+        print(f"Channel files of {action.path} hold different numbers of records {counts}, using {records}.")
+    if records != expected_records(action):
+        print(f"{action.path}: found {records} records, the .con file describes {expected_records(action)}.")
+    if records == 0:
+        print(f"No records found for {action.path}.")
+        return
+
+    channels = len(files)
+    outputs = {}
+    if "stats" in operations:
+        outputs["stats"] = names["stats"]
+        np.lib.format.open_memmap(outputs["stats"], mode="w+", dtype=np.float64, shape=(records, channels, 4))
+    if "repack" in operations:
+        outputs["repack"] = names["repack"]
+        np.lib.format.open_memmap(outputs["repack"], mode="w+", dtype=np.dtype(repack_dtype),
+                                  shape=(records, params.samples, channels))
+
+    # Blocks sized to keep each worker's memory bounded, ranges so every worker gets several of them
+    workers = workers or os.cpu_count() or 1
+    block_records = max(1, int(block_mb * 2 ** 20 // (record_bytes * channels)))
+    range_records = max(block_records, -(-records // (4 * workers)))
+    jobs = [(files, records, params.samples, first, min(first + range_records, records), block_records,
+             operations, outputs, params.rate)
+            for first in range(0, records, range_records)]
+
+    print(f"{action.path}: {records} records x {channels} channels x {params.samples} samples, "
+          f"{len(jobs)} ranges on {workers} workers.")
+    started = time.perf_counter()
+    done = 0
+    totals = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in as_completed([pool.submit(process_range, job) for job in jobs]):
+            count, sums = future.result()
+            done += count
+            for key, value in sums.items():
+                totals[key] = totals.get(key, 0) + value
+            print(f"  {done}/{records} records processed", end="\r")
+    elapsed = time.perf_counter() - started
+    print(f"  {records} records in {elapsed:.2f} s, {records * record_bytes * channels / 2 ** 20 / elapsed:.1f} MB/s")
+
+    if "average" in operations:
+        np.save(names["average"], totals["average"] / records)
+        print(f"  Average record saved to {names['average']}")
+    if "psd" in operations:
+        window = np.hanning(params.samples)
+        psd = totals["psd"] / (records * params.rate * np.sum(window ** 2))
+        # One-sided: fold the negative frequencies onto the positive ones, except DC and Nyquist
+        psd[:, 1:(params.samples + 1) // 2] *= 2
+        np.savez(names["psd"], freqs=np.fft.rfftfreq(params.samples, 1 / params.rate), psd=psd)
+        print(f"  Power spectral density saved to {names['psd']}")
+    for key in ("stats", "repack"):
+        if key in outputs:
+            print(f"  {key.capitalize()} saved to {outputs[key]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process the .bin files of a pyScan run in parallel.")
+    parser.add_argument("confile", type=str, help="The .con file the data was acquired with.")
+    parser.add_argument("--op", nargs="+", choices=OPERATIONS, default=["stats"], help="Operations to run.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    parser.add_argument("--block-mb", type=float, default=64, help="Data each worker reads at a time, in MB.")
+    parser.add_argument("--dtype", type=str, default="float32", help="Sample type for repack (default float32).")
+    parser.add_argument("--force", action="store_true", help="Replace outputs left by an earlier conversion.")
+    args = parser.parse_args()
+
+    action_parser = ActionParser(args.confile)
+    action_parser.parse()
+    if action_parser.validate():
+        raise SystemExit(1)
+    failed = False
+    for a2d in find_a2d_actions(action_parser.actions):
+        if a2d.params.format != "bin":
+            print(f"Skipping {a2d.path}, it was saved in {a2d.params.format} format.")
+            continue
+        try:
+            convert(a2d, args.op, workers=args.workers, block_mb=args.block_mb, repack_dtype=args.dtype,
+                    force=args.force)
+        except FileExistsError as e:
+            print(f"Skipping {a2d.path}: {e}")
+            failed = True
+    if failed:
+        raise SystemExit(1)
@@ -6,19 +6,28 @@ Created on Wed Nov 20 16:24:05 2024
 @curator: Will Hardiman
 """
 
-from py_common import Action
+from py_common import Action, Param
 
 class count(Action):
+    PARAMETERS = {"count": Param(int, 1)}
+
     def __init__(self, filebase):
         super().__init__(filebase)
         self.parent = None
         self.count = 1  # Default count value
+        self.loop_index = 0
+
+    def check_parameters(self):
+        if self.params.count < 0:
+            raise ValueError("count cannot be negative")
+
+    def iterations(self):
+        return self.params.count
 
     def setup(self):
         """Parse parameters and set up for repeated execution."""
         super().setup()
-        # Get the count parameter and ensure it is an integer
-        self.count = int(self.parameters.get("count", self.count))
+        self.count = self.params.count
         print(f"Count action set to repeat {self.count} times.")
 
     def run(self):
@@ -28,6 +37,7 @@ class count(Action):
             return
 
         for i in range(self.count):
+            self.loop_index = i
             print(f"Starting iteration {i+1} of {self.count}.")
             for child in self.child_actions:
                 child.run()
@@ -0,0 +1,213 @@
+"""
+Run-wide memory budget for pyScan buffers.
+
+Acquisition buffers (A2D records, camera rings) are allocated from the shared `budget`. Data queued between a
+producer and its consumer (e.g. records waiting for the compression threads) is reserved from it while queued. When
+a producer would take the total over the budget it is held back until the consumer catches up. If the budget is
+still exceeded, the run either fails with a clear message before the operating system starts paging, or, with
+the spill policy, the buffer is placed in a memory-mapped file on disk instead. The peak usage is reported at the
+end of the run and saved in the run metadata.
+
+Memory that cannot be spilled, such as shared memory for monitors and worker processes, is counted with claim().
+Worker processes (py_actor.py) each get an equal share of the budget, which the parent holds for them, so the
+whole run stays within one limit.
+
+Set the budget with a top-level line in the .con file or on the command line:
+    memory_budget 4 GB [fail]/spill
+    python pyScan.py scan.con --memory-budget 4GB --spill
+Without a budget, usage is still tracked and reported.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+UNITS = {"b": 1, "kb": 2 ** 10, "mb": 2 ** 20, "gb": 2 ** 30, "tb": 2 ** 40}
+
+
+def parse_size(value):
+    """Convert '4GB', '512 mb' or ['4', 'GB'] to bytes."""
+    text = "".join(value if isinstance(value, (list, tuple)) else [value]).strip().lower()
+    number = text.rstrip("kmgtb")
+    unit = text[len(number):] or "b"
+    if unit not in UNITS:
+        unit += "b"  # Allow 4G as well as 4GB
+    try:
+        return int(float(number) * UNITS[unit])
+    except (KeyError, ValueError):
+        raise ValueError(f"cannot read '{text}' as a size, use e.g. 512 MB or 4 GB")
+
+
+def format_size(nbytes):
+    for unit in ["GB", "MB", "kB"]:
+        if nbytes >= UNITS[unit.lower()]:
+            return f"{nbytes / UNITS[unit.lower()]:.1f} {unit}"
+    return f"{nbytes} B"
+
+
+def available_memory():
+    """Physical memory currently available to this process in bytes, or None if it cannot be found out."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class MemoryBudget:
+    """Accounts for the buffers of a run against a byte limit, blocking or refusing requests that exceed it."""
+
+    def __init__(self, limit=None, spill=False, spill_dir=None):
+        self.limit = limit
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.used = 0
+        self.peak = 0
+        self.by_owner = {}        # owner -> bytes currently held
+        self.peak_by_owner = {}
+        self.buffers = {}         # id(array) -> (owner, nbytes, spill file or None)
+        self.spilled = 0
+        self.waited_ns = 0        # Time producers spent held back by the budget
+        self.condition = threading.Condition()
+
+    def reset(self):
+        """Start the statistics afresh, e.g. for the next configuration of a batch."""
+        with self.condition:
+            self.peak = self.used
+            self.peak_by_owner = {owner: nbytes for owner, nbytes in self.by_owner.items() if nbytes}
+            self.spilled = 0
+            self.waited_ns = 0
+
+    def configure(self, limit, spill=False, spill_dir=None):
+        """Set the limit in bytes (None for no limit) and what to do with buffers that do not fit."""
+        self.limit = limit
+        self.spill = spill
+        self.spill_dir = spill_dir
+        available = available_memory()
+        if limit is not None:
+            print(f"Memory budget {format_size(limit)}, {'spilling to disk' if spill else 'failing'} when exceeded.")
+            if available is not None and limit > available:
+                print(f"Warning: the memory budget is larger than the {format_size(available)} available, "
+                      f"the system may page before it is reached.")
+
+    def describe_usage(self):
+        owners = sorted(self.by_owner.items(), key=lambda item: -item[1])
+        return ", ".join(f"{owner} {format_size(nbytes)}" for owner, nbytes in owners if nbytes) or "nothing"
+
+    def fits(self, nbytes):
+        return self.limit is None or self.used + nbytes <= self.limit
+
+    def take(self, owner, nbytes):
+        self.used += nbytes
+        self.by_owner[owner] = self.by_owner.get(owner, 0) + nbytes
+        self.peak = max(self.peak, self.used)
+        self.peak_by_owner[owner] = max(self.peak_by_owner.get(owner, 0), self.by_owner[owner])
+
+    def reserve(self, owner, nbytes, timeout=None):
+        """
+        Reserve nbytes for data queued by `owner`, waiting up to timeout seconds (forever if None) for other users
+        to release enough. Returns False if the time ran out, the caller can then make room itself or give up.
+        """
+        started = time.perf_counter_ns()
+        with self.condition:
+            if self.limit is not None and nbytes > self.limit:
+                raise MemoryError(f"{owner} needs {format_size(nbytes)}, more than the whole memory budget of "
+                                  f"{format_size(self.limit)}.")
+            fitted = self.condition.wait_for(lambda: self.fits(nbytes), timeout)
+            self.waited_ns += time.perf_counter_ns() - started
+            if fitted:
+                self.take(owner, nbytes)
+            return fitted
+
+    def shortage(self, owner, nbytes):
+        """Message for a request of nbytes by owner that does not fit."""
+        return (f"{owner} needs {format_size(nbytes)} but only {format_size(max(self.limit - self.used, 0))} of the "
+                f"{format_size(self.limit)} memory budget is left (in use: {self.describe_usage()}). Reduce samples, "
+                f"channels or buffer sizes, raise the budget or allow spilling to disk.")
+
+    def claim(self, owner, nbytes):
+        """Count memory allocated elsewhere (e.g. shared memory) against the budget, give it back with release()."""
+        with self.condition:
+            if not self.fits(nbytes):
+                raise MemoryError(self.shortage(owner, nbytes))
+            self.take(owner, nbytes)
+
+    def release(self, owner, nbytes):
+        """Return bytes reserved by `owner`, waking producers held back by the budget."""
+        with self.condition:
+            self.used -= nbytes
+            self.by_owner[owner] -= nbytes
+            self.condition.notify_all()
+
+    def allocate(self, owner, shape, dtype=np.float64):
+        """
+        Return an uninitialised array counted against the budget, to be given back with free().
+
+        If it does not fit, it is spilled to a memory-mapped file when the spill policy is on, otherwise MemoryError
+        is raised, naming what is holding the memory.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        with self.condition:
+            if self.fits(nbytes):
+                self.take(owner, nbytes)
+                array = np.empty(shape, dtype=dtype)
+                self.buffers[id(array)] = (owner, nbytes, None)
+                return array
+            if not self.spill:
+                raise MemoryError(self.shortage(owner, nbytes))
+            tag = "".join(c if c.isalnum() else "_" for c in owner)
+            handle, filename = tempfile.mkstemp(prefix=f"pyScan_{tag}_", suffix=".spill",
+                                                dir=self.spill_dir)
+            os.close(handle)
+            array = np.memmap(filename, dtype=dtype, mode="w+", shape=shape)
+            self.buffers[id(array)] = (owner, 0, filename)
+            self.spilled += nbytes
+            print(f"Memory budget exceeded, {owner} buffer of {format_size(nbytes)} spilled to {filename}.")
+            return array
+
+    def free(self, array):
+        """Give back an array from allocate()."""
+        if array is None:
+            return
+        with self.condition:
+            entry = self.buffers.pop(id(array), None)
+        if entry is None:
+            return
+        owner, nbytes, filename = entry
+        if filename is not None:
+            del array
+            try:
+                os.remove(filename)
+            except OSError as e:
+                # Windows refuses while the file is still mapped somewhere
+                print(f"Could not remove spill file {filename}: {e}")
+        else:
+            self.release(owner, nbytes)
+
+    def summary(self):
+        return {"limit_bytes": self.limit,
+                "peak_bytes": self.peak,
+                "peak_bytes_by_owner": dict(self.peak_by_owner),
+                "spilled_bytes": self.spilled,
+                "backpressure_wait_s": self.waited_ns / 1e9}
+
+    def report(self):
+        """Print the peak usage of the run and return the summary for the run metadata."""
+        limit = f" of {format_size(self.limit)}" if self.limit is not None else ""
+        print(f"Peak buffer memory {format_size(self.peak)}{limit}, "
+              f"producers held back for {self.waited_ns / 1e9:.3f} s"
+              + (f", {format_size(self.spilled)} spilled to disk." if self.spilled else "."))
+        for owner, nbytes in sorted(self.peak_by_owner.items(), key=lambda item: -item[1]):
+            print(f"    {owner}: {format_size(nbytes)}")
+        return self.summary()
+
+
+budget = MemoryBudget()  # Shared by every action of the run
@@ -0,0 +1,255 @@
+"""
+Live monitoring of A2D data through a shared memory ring buffer.
+
+The acquiring process publishes every record (or a decimated copy) into a fixed number of slots and never waits
+for anybody. A monitor process attaches by name and reads at its own pace. If it falls behind, the records it
+missed are counted as dropped; the count is written back to the buffer so the acquiring process can report it
+at the end of the run.
+
+Each slot carries a sequence number that is cleared while the slot is written and set once the write is done,
+so a reader can tell a complete record from one that was overwritten while it was being copied.
+
+Run a monitor next to pyScan with:
+    python py_monitor.py <name> [--plot] [--interval 0.5]
+where <name> is printed by A2D at setup (pyScan_<confile>_<action path>, e.g. pyScan_example_count0_A2D0, unless
+`monitor_name` is given).
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = 0x70795363616E  # "pyScan"
+HEADER_FIELDS = 8  # magic, slots, channels, samples, write_seq, reader_drops, reader_seq, producer pid
+LABEL_BYTES = 1024  # JSON description of the channels
+
+
+def process_alive(pid):
+    """Whether a process with this pid is running."""
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Running, as another user
+    return True
+
+
+class SharedRingBuffer:
+    """Single producer, lock-free ring of (channels, samples) float64 records in shared memory."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        slots, channels, samples = (int(v) for v in self.header[1:4])
+        offset = self.header.nbytes
+        self.labels = shm.buf[offset:offset + LABEL_BYTES]
+        offset += LABEL_BYTES
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.slot_seq.nbytes
+        self.data = np.ndarray((slots, channels, samples), dtype=np.float64, buffer=shm.buf, offset=offset)
+        self.last_seq = -1  # Reader side: last sequence number returned
+        self.dropped = 0    # Reader side: records missed since attaching
+
+    @staticmethod
+    def size(slots, channels, samples):
+        """Bytes of shared memory used by a buffer of this shape."""
+        return (HEADER_FIELDS + slots) * 8 + LABEL_BYTES + slots * channels * samples * 8
+
+    @classmethod
+    def create(cls, name, slots, channels, samples, labels=None):
+        """
+        Create the buffer. A buffer whose producer is still running is never replaced, a stale one left behind by a
+        crashed run is.
+        """
+        size = cls.size(slots, channels, samples)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            existing = shared_memory.SharedMemory(name=name)
+            header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=existing.buf) \
+                if existing.size >= HEADER_FIELDS * 8 else None
+            pyscan = header is not None and header[0] == MAGIC
+            pid = int(header[7]) if pyscan else 0
+            del header
+            existing.close()
+            if not pyscan:
+                raise FileExistsError(f"Shared memory {name} exists and is not a pyScan monitor buffer.")
+            # Windows frees shared memory with its last handle, so there a name in use always has a live producer
+            if os.name == "nt" or process_alive(pid):
+                user = "another action of this run" if pid == os.getpid() else f"process {pid}"
+                raise FileExistsError(f"Shared memory {name} is in use by {user}, give this A2D a different "
+                                      f"monitor_name.")
+            existing.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = [MAGIC, slots, channels, samples, 0, 0, -1, os.getpid()]
+        del header
+        ring = cls(shm, owner=True)
+        ring.slot_seq[:] = -1
+        text = json.dumps(labels or {}).encode()[:LABEL_BYTES]
+        ring.labels[:len(text)] = text
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing buffer as a reader."""
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Readers must not unlink the buffer when they exit, that is up to the producer
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except (ImportError, AttributeError, KeyError):
+            pass
+        if int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0]) != MAGIC:
+            shm.close()
+            raise ValueError(f"Shared memory {name} is not a pyScan monitor buffer.")
+        ring = cls(shm, owner=False)
+        # Records published before the reader attached were never there to be read, so they are not drops
+        ring.last_seq = ring.published - 1
+        return ring
+
+    @property
+    def description(self):
+        return json.loads(bytes(self.labels).rstrip(b"\0") or b"{}")
+
+    @property
+    def published(self):
+        return int(self.header[4])
+
+    @property
+    def reader_drops(self):
+        return int(self.header[5])
+
+    def publish(self, record, decimate=1):
+        """Copy a (channels, samples) record into the next slot. Never blocks."""
+        seq = int(self.header[4])
+        slot = seq % len(self.slot_seq)
+        self.slot_seq[slot] = -1
+        np.copyto(self.data[slot], record[:, ::decimate] if decimate > 1 else record)
+        self.slot_seq[slot] = seq
+        self.header[4] = seq + 1
+
+    def read_next(self, out=None):
+        """
+        Return the oldest record not yet read, or None if the reader is up to date.
+
+        Records overwritten before the reader got to them are skipped and added to `dropped`.
+        """
+        slots = len(self.slot_seq)
+        while True:
+            written = int(self.header[4])
+            seq = self.last_seq + 1
+            if seq >= written:
+                return None
+            # The slot after the newest one may already be in the middle of a write
+            oldest = max(0, written - slots + 1)
+            if seq < oldest:
+                self.skip(oldest - seq)
+                continue
+            slot = seq % slots
+            if self.slot_seq[slot] != seq:
+                self.skip(1)
+                continue
+            if out is None:
+                out = np.empty_like(self.data[slot])
+            np.copyto(out, self.data[slot])
+            if self.slot_seq[slot] != seq:
+                # Overwritten while copying
+                self.skip(1)
+                continue
+            self.last_seq = seq
+            self.header[6] = seq
+            return out
+
+    def read_latest(self):
+        """Return the newest complete record, counting everything skipped on the way as dropped."""
+        written = int(self.header[4])
+        if written - 1 > self.last_seq + 1:
+            self.skip(written - 1 - (self.last_seq + 1))
+        return self.read_next()
+
+    def skip(self, count):
+        self.last_seq += count
+        self.dropped += count
+        self.header[5] = self.dropped
+
+    def close(self):
+        """Release the views and the shared memory, removing it if this is the producer."""
+        self.labels.release()
+        del self.header, self.labels, self.slot_seq, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def monitor_text(ring, interval):
+    """Print per-channel statistics of the latest record every `interval` seconds."""
+    names = ring.description.get("channels", [])
+    received = 0
+    while True:
+        record = ring.read_latest()
+        if record is not None:
+            received += 1
+            stats = ", ".join(
+                f"{names[i] if i < len(names) else i}: {np.mean(ch):.6f} +/- {np.std(ch):.6f} V"
+                for i, ch in enumerate(record))
+            print(f"[{ring.last_seq}] {stats} (received {received}, dropped {ring.dropped})")
+        time.sleep(interval)
+
+
+def monitor_plot(ring, interval):
+    """Plot the latest record, refreshed every `interval` seconds."""
+    import matplotlib.pyplot as plt
+
+    names = ring.description.get("channels", [])
+    plt.ion()
+    figure, axes = plt.subplots()
+    lines = [axes.plot(ring.data[0, i], label=names[i] if i < len(names) else str(i))[0]
+             for i in range(ring.data.shape[1])]
+    axes.set_xlabel("Sample")
+    axes.set_ylabel("Voltage (V)")
+    axes.legend(loc="upper right")
+    while plt.fignum_exists(figure.number):
+        record = ring.read_latest()
+        if record is not None:
+            for line, channel_data in zip(lines, record):
+                line.set_ydata(channel_data)
+            axes.relim()
+            axes.autoscale_view()
+            axes.set_title(f"Record {ring.last_seq}, dropped {ring.dropped}")
+        plt.pause(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch A2D data published by a running pyScan.")
+    parser.add_argument("name", type=str, help="Name of the shared memory buffer, e.g. pyScan_example_A2D.")
+    parser.add_argument("--plot", action="store_true", help="Plot the latest record instead of printing stats.")
+    parser.add_argument("--interval", type=float, default=0.5, help="Refresh interval in seconds.")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            ring = SharedRingBuffer.attach(args.name)
+            break
+        except FileNotFoundError:
+            print(f"Waiting for {args.name} to be created...")
+            time.sleep(1)
+
+    try:
+        if args.plot:
+            monitor_plot(ring, args.interval)
+        else:
+            monitor_text(ring, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Monitor stopped after dropping {ring.dropped} records.")
+        ring.close()
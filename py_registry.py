@@ -0,0 +1,104 @@
+"""
+Registry of the actions available to pyScan.
+
+Action classes are found by reading the source of every py_*.py module next to pyScan.py with `ast`, without
+importing anything. A class is an action if it derives, directly or through other action classes, from Action.
+The result is cached in ~/.cache/pyScan/registry.json and a module is only read again when its size or
+modification time changes.
+"""
+
+import ast
+import glob
+import json
+import os
+
+from py_common import CACHE_DIR
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_FILE = os.path.join(CACHE_DIR, "registry.json")
+
+
+def scan_module(filename):
+    """Return {class name: [base class names]} for the top-level classes of a module."""
+    with open(filename, "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read(), filename=filename)
+    classes = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            classes[node.name] = [base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+                                  for base in node.bases]
+    return classes
+
+
+class ActionRegistry:
+    def __init__(self, module_dir=MODULE_DIR):
+        self.module_dir = module_dir
+        self.modules = {}  # module name -> {"stamp": [mtime, size], "classes": {name: bases}}
+        self.actions = {}  # action name -> module name
+
+    def load(self):
+        """Bring the registry up to date, reading only modules that changed since the cached scan."""
+        cached = {}
+        try:
+            with open(REGISTRY_FILE, "r") as file:
+                cached = json.load(file).get(self.module_dir, {})
+        except (OSError, ValueError):
+            pass
+
+        changed = False
+        for filename in sorted(glob.glob(os.path.join(self.module_dir, "py_*.py"))):
+            module_name = os.path.splitext(os.path.basename(filename))[0]
+            info = os.stat(filename)
+            stamp = [info.st_mtime, info.st_size]
+            entry = cached.get(module_name)
+            if entry is None or entry["stamp"] != stamp:
+                try:
+                    entry = {"stamp": stamp, "classes": scan_module(filename)}
+                except (SyntaxError, UnicodeDecodeError) as e:
+                    print(f"Skipping {module_name} in action registry: {e}")
+                    continue
+                changed = True
+            self.modules[module_name] = entry
+        changed = changed or set(cached) != set(self.modules)
+
+        self.resolve()
+        if changed:
+            self.save()
+        return self
+
+    def resolve(self):
+        """Work out which classes are actions by following base classes back to Action."""
+        action_classes = {"Action"}
+        growing = True
+        while growing:
+            growing = False
+            for entry in self.modules.values():
+                for name, bases in entry["classes"].items():
+                    if name not in action_classes and action_classes.intersection(bases):
+                        action_classes.add(name)
+                        growing = True
+        self.actions = {}
+        for module_name, entry in self.modules.items():
+            for name, bases in entry["classes"].items():
+                if name in action_classes and action_classes.intersection(bases):
+                    # Prefer the conventional py_<name> module if a name is defined twice
+                    if name not in self.actions or module_name == f"py_{name}":
+                        self.actions[name] = module_name
+
+    def save(self):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            try:
+                with open(REGISTRY_FILE, "r") as file:
+                    registry = json.load(file)
+            except (OSError, ValueError):
+                registry = {}
+            registry[self.module_dir] = self.modules
+            with open(REGISTRY_FILE, "w") as file:
+                json.dump(registry, file)
+        except OSError as e:
+            print(f"Could not save the action registry: {e}")
+
+    def module_for(self, action_name):
+        """Return the module defining `action_name`, or None if there is no such action."""
+        return self.actions.get(action_name)
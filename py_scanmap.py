@@ -0,0 +1,140 @@
+"""
+Scan map action: reduces every record of its parent A2D as it is acquired and writes the result into a memory-mapped
+N-D map, so the image is ready as soon as the scan ends.
+
+The map is indexed by scan point: one axis per enclosing stage (Stage1D and derived classes), outermost first, of
+the length of its scan grid. Without a stage, the enclosing loops (count, timedloop) give the axes instead. The last
+two axes are channel and reduction, so every reduction of every channel is kept in the same file. Points not
+visited yet are NaN, and a point visited again (e.g. a count around a stage) holds its latest value.
+
+Supported parameters:
+    reduce mean std             # one or more of mean, std, min, max, pp, rms, lockin, phase
+    channels ai0 ai1            # channels of the parent A2D to keep, default all
+    lockin 1370                 # reference frequency in Hz for lockin (amplitude) and phase (radians)
+
+Output file:
+    <confile>_<tag>_map.npy     (*scan axes, channels, reductions) float64, open with np.load(..., mmap_mode="r")
+The axis, channel and reduction names go into the run metadata.
+"""
+
+import os
+
+import numpy as np
+
+from py_common import Action, Param, words
+from py_stage import Stage1D
+
+REDUCTIONS = ["mean", "std", "min", "max", "pp", "rms", "lockin", "phase"]
+
+
+class scanmap(Action):
+    PARAMETERS = {
+        "reduce": Param(words, ["mean"], nargs="+"),
+        "channels": Param(words, nargs="+"),
+        "lockin": Param(float),
+    }
+
+    def __init__(self, filebase):
+        super().__init__(filebase)
+        self.parent = None
+        self.axes = []            # Enclosing actions giving the map axes, outermost first
+        self.rows = None          # Rows of the parent's data to reduce, a list or slice
+        self.map = None
+        self.reference = None     # exp(-2 pi i f t) for the lock-in reductions
+        self.records = 0
+
+    def check_parameters(self):
+        unknown = [name for name in self.params.reduce if name not in REDUCTIONS]
+        if unknown:
+            raise ValueError(f"unknown reduction(s) {unknown}, use {REDUCTIONS}")
+        if {"lockin", "phase"}.intersection(self.params.reduce) and not self.params.lockin:
+            raise ValueError("the lockin and phase reductions need a 'lockin' frequency")
+        if not hasattr(self.parent, "data"):
+            raise ValueError("scanmap must be placed inside an A2D action")
+
+    def map_axes(self):
+        """Enclosing stages, or enclosing loops if there is no stage, outermost first, with their lengths."""
+        enclosing = []
+        action = self.parent
+        while action is not None:
+            enclosing.append(action)
+            action = action.parent
+        enclosing.reverse()
+        stages = [action for action in enclosing if isinstance(action, Stage1D)]
+        if stages:
+            return stages, [stage.num_points() for stage in stages]
+        loops = [action for action in enclosing if action.loop_index is not None and action.iterations() > 1]
+        return loops, [loop.iterations() for loop in loops]
+
+    def setup(self):
+        """Work out the shape of the map and create it on disk."""
+        super().setup()
+        self.axes, shape = self.map_axes()
+
+        # The parent's parameters, its own setup has not run yet when its children are set up
+        acquisition = self.parent.params
+        channels = list(acquisition.channels)
+        if self.params.channels:
+            missing = [channel for channel in self.params.channels if channel not in channels]
+            if missing:
+                raise ValueError(f"scanmap channels {missing} are not acquired by {self.parent.path}")
+            self.rows = [channels.index(channel) for channel in self.params.channels]
+            channels = self.params.channels
+        else:
+            self.rows = slice(None)  # Every channel, without copying the record
+
+        if {"lockin", "phase"}.intersection(self.params.reduce):
+            t = np.arange(acquisition.samples) / acquisition.rate
+            self.reference = np.exp(-2j * np.pi * self.params.lockin * t)
+
+        filename = f"{self.confile_name}_{self.file_tag()}_map.npy"
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        shape = tuple(shape) + (len(channels), len(self.params.reduce))
+        self.map = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float64, shape=shape)
+        self.map[...] = np.nan
+        self.metadata.update({"map_file": filename,
+                              "axes": [axis.path for axis in self.axes] + ["channel", "reduction"],
+                              "shape": list(shape),
+                              "channels": list(channels),
+                              "reductions": list(self.params.reduce)})
+        print(f"Scan map {shape} of {self.params.reduce} will be saved to {filename}.")
+
+    def reduce(self, data):
+        """Return (channels, reductions) for one (channels, samples) record."""
+        out = np.empty((len(data), len(self.params.reduce)))
+        demodulated = None
+        for i, name in enumerate(self.params.reduce):
+            if name == "mean":
+                out[:, i] = data.mean(axis=1)
+            elif name == "std":
+                out[:, i] = data.std(axis=1)
+            elif name == "min":
+                out[:, i] = data.min(axis=1)
+            elif name == "max":
+                out[:, i] = data.max(axis=1)
+            elif name == "pp":
+                out[:, i] = np.ptp(data, axis=1)
+            elif name == "rms":
+                out[:, i] = np.sqrt(np.einsum("ij,ij->i", data, data) / data.shape[1])
+            else:
+                if demodulated is None:
+                    demodulated = 2 * (data @ self.reference) / data.shape[1]
+                out[:, i] = np.abs(demodulated) if name == "lockin" else np.angle(demodulated)
+        return out
+
+    def run(self):
+        """Reduce the record the parent A2D has just acquired into its place in the map."""
+        index = tuple(axis.loop_index for axis in self.axes)
+        self.map[index] = self.reduce(self.parent.data[self.rows])
+        self.records += 1
+        self.run_children()
+
+    def cleanup(self):
+        """Flush the map to disk."""
+        if self.map is not None:
+            self.map.flush()
+            self.metadata["records"] = self.records
+            print(f"Scan map {self.metadata['map_file']} written, {self.records} records reduced.")
+            self.map = None
+        super().cleanup()
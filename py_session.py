@@ -0,0 +1,54 @@
+"""
+Pool of open hardware sessions (DAQ tasks, serial ports, Kinesis and camera handles) shared by the actions of a run.
+
+Actions open hardware through `sessions.acquire(key, open_session, close_session)` and give it back with
+`sessions.release(key)`. Actions using the same key share one session, e.g. two ASI axes on one serial port. Normally
+a session is closed when its last user releases it. In batch mode (pyScan.py --batch) `keep_open` is set, so a
+session stays open after a configuration finishes and the next configuration asking for the same key gets it back
+without reconnecting. The key must therefore describe everything the session was opened with.
+"""
+
+
+class SessionPool:
+    def __init__(self):
+        self.sessions = {}      # key -> [session, users, close_session]
+        self.keep_open = False  # Keep idle sessions for the next configuration (batch mode)
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self, key, open_session, close_session):
+        """Return the session for `key`, calling open_session() if there is none yet."""
+        entry = self.sessions.get(key)
+        if entry is None:
+            entry = [open_session(), 0, close_session]
+            self.sessions[key] = entry
+            self.opened += 1
+        elif entry[1] == 0:
+            self.reused += 1
+            print(f"Reusing open session {key}.")
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        """Give back a session. It is closed when unused, unless idle sessions are kept for the next run."""
+        entry = self.sessions.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0 and not self.keep_open:
+            self.close(key)
+
+    def close(self, key):
+        session, _, close_session = self.sessions.pop(key)
+        try:
+            close_session(session)
+        except Exception as e:
+            print(f"Closing session {key} failed: {e}")
+
+    def close_all(self):
+        """Close every session, used or not, e.g. at the end of a batch."""
+        for key in list(self.sessions):
+            self.close(key)
+
+
+sessions = SessionPool()  # Shared by every action in the process
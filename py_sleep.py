@@ -7,9 +7,15 @@ Created on Fri Nov 22 17:19:33 2024
 """
 
 import time
-from py_common import Action
+from py_common import Action, Param, sleep_until
 
 class sleep(Action):
+    PARAMETERS = {
+        "hours": Param(float, 0.0),
+        "minutes": Param(float, 0.0),
+        "seconds": Param(float, 0.0),
+    }
+
     def __init__(self, filebase=None):
         """
         Initialize the Sleep action.
@@ -25,12 +31,12 @@ class sleep(Action):
         """
         super().setup()
         # Extract user-specified times
-        hours = float(self.parameters.get("hours", 0))
-        minutes = float(self.parameters.get("minutes", 0))
-        seconds = float(self.parameters.get("seconds", 0))
+        hours = self.params.hours
+        minutes = self.params.minutes
+        seconds = self.params.seconds
         
         # Convert to total seconds
-        self.sleep_time = int(hours * 3600 + minutes * 60 + seconds)
+        self.sleep_time = hours * 3600 + minutes * 60 + seconds
         print(f"Sleep action set up to wait for {self.sleep_time} seconds.")
 
     def run(self):
@@ -39,7 +45,7 @@ class sleep(Action):
         """
         if self.sleep_time > 0:
             print(f"Sleeping for {self.sleep_time} seconds...")
-            time.sleep(self.sleep_time)
+            sleep_until(time.monotonic_ns() + int(self.sleep_time * 1e9))
             print("Sleep completed.")
         else:
             print("Sleep time is zero or invalid. Skipping sleep.")
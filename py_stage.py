@@ -5,7 +5,7 @@ Supported parameters:
     scan start step end
     axis_name name
     scan_mode [relative]/absolute
-    restore true # always true if present, false if not present
+    restore [true]/false # true if given without a value, false if not present
 
 Derived classes must implement:
     get_here
@@ -14,22 +14,27 @@ Derived classes must implement:
 Optional setup and init can supplement superclass setup by including super().setup()
 
 """
-from py_common import Action
+from py_common import Action, Param, boolean, floats
 
 class Stage1D(Action):
-    def __init__(self, **kwargs):
+    PARAMETERS = {
+        "axis_name": Param(str, ""),
+        "scan": Param(floats, nargs=3, required=True),
+        "scan_mode": Param(str, "relative", choices=["relative", "absolute"]),
+        "restore": Param(boolean, False, nargs="?"),
+    }
+
+    def __init__(self, confile_name=""):
         """
-        Initializes the 1D stage.
-        
-        Parameters:
-        - axis_name (str): Name of the axis (e.g., 'X', 'Y', 'Z').
+        Initializes the 1D stage. The axis name is read from the parameters at setup.
         """
-        super().__init__(**kwargs)
+        super().__init__(confile_name)
         self.axis_name = ""
         
         # Scan logic/prealloc
         self.scan_points = []  # List of points to scan
         self.current_point_index = 0  # Index of the next point to visit
+        self.loop_index = 0  # Index of the point the stage is currently at
         self.initial_position = 0.0
         
         # Scan options
@@ -37,42 +42,39 @@ class Stage1D(Action):
         self.step = 0.0
         self.end = 0.0
             
+    def check_parameters(self):
+        start, step, end = self.params.scan
+        if step == 0 or (end - start) / step < 0:
+            raise ValueError(f"scan step {step} does not lead from {start} to {end}")
+
+    def num_points(self):
+        """
+        Number of points in the scan grid, known once the parameters are compiled.
+        """
+        start, step, end = self.params.scan
+        return int((end - start) / step) + 1
+
     def setup(self):
         """
         Setup method for the stage, called before the action is run.
         """
-        # I guess I need the axis name somewhere
-        self.axis_name = self.parameters.get("axis_name", "")[0]
-
         super().setup()
+        self.axis_name = self.params.axis_name
         print(f"Setting up {self.axis_name}-Axis Stage.")
         
-        # Parse the scan parameters and scan mode
-        scan_mode = self.parameters.get("scan_mode", ["relative"])[0]  # Default to relative mode
-        scan_params = self.parameters.get("scan", None)
-
-        if not scan_params:
-            raise ValueError(f"No scan parameters provided for {self.axis_name}-Axis.")
-        
-        try:
-            self.start = float(scan_params[0])
-            self.step = float(scan_params[1])
-            self.end = float(scan_params[2])
-        except (ValueError, IndexError) as e:
-            raise ValueError(f"Invalid scan parameters for {self.axis_name}-Axis: {e}")
+        # Scan parameters and mode were checked when the parameters were compiled
+        self.start, self.step, self.end = self.params.scan
         
         # Maybe find where we are
-        if scan_mode == "relative" or "restore" in self.parameters:
+        if self.params.scan_mode == "relative" or self.params.restore:
             # Get current location (only needed for relative scans or when restoring)
             self.get_here()
 
         # Choose the appropriate grid constructor
-        if scan_mode == "relative":
+        if self.params.scan_mode == "relative":
             self.construct_grid_relative()
-        elif scan_mode == "absolute":
-            self.construct_grid_absolute()
         else:
-            raise ValueError(f"Unknown scan mode '{scan_mode}' for {self.axis_name}-Axis.")
+            self.construct_grid_absolute()
 
     def run(self):
         """
@@ -86,24 +88,25 @@ class Stage1D(Action):
         self.go_to(next_point)
 
         # If there are child actions, run them as well.
-        for child in self.children:
-            child.run()
+        self.run_children()
 
     def cleanup(self):
         """
         Cleanup method for the stage, called after the action is run.
         """
-        if "restore" in self.parameters:
+        if self.params is not None and self.params.restore:
             self.go_to(self.initial_position)
 
         super().cleanup()
         print(f"Cleaning up {self.axis_name}-Axis Stage.")
 
-    def construct_grid_relative(self, initial_position=self.initial_position):
+    def construct_grid_relative(self, initial_position=None):
         """
         Constructs a regular grid of points relative to the starting position.
         """
-        num_points = int((self.end - self.start) / self.step) + 1
+        if initial_position is None:
+            initial_position = self.initial_position
+        num_points = self.num_points()
         self.scan_points = [initial_position + i * self.step for i in range(num_points)]
         self.current_point_index = 0  # Reset index
         print(f"{self.axis_name}-Axis Grid: {self.scan_points}")
@@ -125,6 +128,7 @@ class Stage1D(Action):
             raise ValueError("Scan grid is empty. Construct a grid first.")
         
         next_point = self.scan_points[self.current_point_index]
+        self.loop_index = self.current_point_index
         self.current_point_index = (self.current_point_index + 1) % len(self.scan_points)  # Wrap around
         return next_point
 
@@ -0,0 +1,329 @@
+"""
+Streams A2D records to other processes over a local socket while the run is going.
+
+A2D actions with `stream true` publish every record to a StreamServer listening on localhost TCP or a Unix domain
+socket (`stream_address`, default tcp:127.0.0.1:5757). Actions giving the same address share one server. Every client
+that connects receives every record of every stream from then on. Each client has its own bounded queue and sender
+thread. When a client falls behind, its oldest queued records are dropped, so a slow client never holds up the
+acquisition or the other clients. Records are copied once per record, not once per client, and sent straight from
+the array's memory. Queued copies are counted against the run's memory budget (py_memory.py) until the last client
+has sent or dropped them. A record that does not fit is not streamed, which clients see as a gap in its sequence.
+Actions sharing a server get the longest `stream_queue` any of them asks for.
+
+Framing, all little endian. Every message is a FRAME header followed by `length` bytes:
+    kind 0 (description)  JSON: {"streams": [{"id", "path", "dtype", "shape", ...}, ...]}, sent on connecting and
+                          whenever a stream is added
+    kind 1 (record)       `depth` int64 loop indices, then the record as raw `dtype` with shape `shape`
+The header also carries the stream id, the record's sequence number in its stream (gaps show drops) and its
+timestamp in ns.
+
+Read a stream from Python with read_frames, or watch one with:
+    python py_stream.py tcp:127.0.0.1:5757
+"""
+
+import argparse
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from py_memory import budget
+
+MAGIC = b"PYSF"
+FRAME = struct.Struct("<4sBBHIQqQ")  # magic, kind, depth, reserved, stream, sequence, timestamp_ns, length
+DESCRIPTION = 0
+RECORD = 1
+DEFAULT_ADDRESS = "tcp:127.0.0.1:5757"
+
+
+def parse_address(address):
+    """Return (family, socket address) for 'tcp:host:port' or 'unix:/path/to/socket'."""
+    kind, _, rest = address.partition(":")
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if kind == "unix":
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix domain sockets are not available on this platform, use a tcp: address")
+        return socket.AF_UNIX, rest
+    raise ValueError(f"stream address '{address}' should look like tcp:127.0.0.1:5757 or unix:/tmp/pyscan.sock")
+
+
+class ClientConnection:
+    """One connected client: a bounded queue of frames and the thread sending them."""
+
+    def __init__(self, sock, name, queue_length, on_close, on_done):
+        self.sock = sock
+        self.name = name
+        self.queue = collections.deque(maxlen=queue_length)
+        self.condition = threading.Condition()
+        self.closing = False
+        self.sent = 0
+        self.dropped = 0
+        self.on_close = on_close
+        self.on_done = on_done  # Called with the payload of every frame sent or dropped
+        self.thread = threading.Thread(target=self.send_queued, name=f"stream-{name}", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, header, payload):
+        """Queue a frame, dropping the oldest queued one if the client is a whole queue behind."""
+        evicted = None
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                evicted = self.queue[0]
+            self.queue.append((header, payload))
+            self.condition.notify()
+        if evicted is not None:
+            self.on_done(evicted[1])
+
+    def resize(self, queue_length):
+        """Change how many frames may be queued."""
+        with self.condition:
+            self.queue = collections.deque(self.queue, maxlen=queue_length)
+
+    def send_queued(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.queue or self.closing)
+                    if not self.queue:
+                        break
+                    header, payload = self.queue.popleft()
+                try:
+                    self.sock.sendall(header)
+                    if payload is not None:
+                        self.sock.sendall(memoryview(payload).cast("B"))
+                finally:
+                    self.on_done(payload)
+                self.sent += 1
+        except OSError:
+            pass  # Client went away
+        finally:
+            self.sock.close()
+            self.on_close(self)
+
+    def close(self):
+        """Send what is queued, then disconnect."""
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+
+
+class StreamServer:
+    """Serves the records of one or more actions to any number of local clients."""
+
+    open_servers = {}  # address -> shared server
+
+    def __init__(self, address, queue_length=64):
+        self.address = address
+        self.queue_length = queue_length
+        family, self.target = parse_address(address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(self.target):
+                os.remove(self.target)  # Left behind by a crashed run
+        else:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.target)
+        self.listener.listen()
+        self.listener.settimeout(0.5)  # So the accept thread notices close()
+        self.users = 0
+        self.streams = []     # Description of each stream, the position is the stream id
+        self.sequences = []   # Next sequence number of each stream
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.owner = f"stream {address}"  # Name of the queued records in the memory budget
+        self.holders = {}  # id(payload) -> number of clients still to send or drop it
+        self.holders_lock = threading.Lock()
+        self.skipped = 0   # Records not streamed because the memory budget was full
+        self.running = True
+        self.connections = 0
+        self.acceptor = threading.Thread(target=self.accept_clients, name="stream-accept", daemon=True)
+        self.acceptor.start()
+
+    @classmethod
+    def open(cls, address=DEFAULT_ADDRESS, queue_length=64):
+        """Return the server for `address`, starting it on first use."""
+        server = cls.open_servers.get(address)
+        if server is None:
+            server = cls(address, queue_length)
+            cls.open_servers[address] = server
+            print(f"Streaming records on {address}. Watch with: python py_stream.py {address}")
+        elif queue_length > server.queue_length:
+            print(f"Stream queues on {address} lengthened from {server.queue_length} to {queue_length} records.")
+            server.queue_length = queue_length
+            with server.lock:
+                for client in server.clients:
+                    client.resize(queue_length)
+        server.users += 1
+        return server
+
+    def description_frame(self):
+        payload = json.dumps({"streams": self.streams}).encode()
+        return FRAME.pack(MAGIC, DESCRIPTION, 0, 0, 0, 0, 0, len(payload)), payload
+
+    def accept_clients(self):
+        while self.running:
+            try:
+                sock, peer = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            if sock.family != getattr(socket, "AF_UNIX", None):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Records go out as soon as queued
+            self.connections += 1
+            client = ClientConnection(sock, str(peer or self.connections), self.queue_length, self.remove_client,
+                                      self.release_payload)
+            with self.lock:
+                client.enqueue(*self.description_frame())
+                self.clients.add(client)
+            print(f"Stream client {client.name} connected to {self.address}.")
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.discard(client)
+        # Nothing is queued for the client once it is out of the set, give back what it did not send
+        while client.queue:
+            self.release_payload(client.queue.popleft()[1])
+        if client.dropped:
+            print(f"Stream client {client.name} disconnected, {client.sent} frames sent, {client.dropped} dropped.")
+
+    def add_stream(self, action, dtype, shape, **info):
+        """Register a stream of fixed-shape records from `action`, returning its stream id."""
+        with self.lock:
+            self.streams.append(dict(id=len(self.streams), path=action.path, dtype=np.dtype(dtype).str,
+                                     shape=list(shape), **info))
+            self.sequences.append(0)
+            frame = self.description_frame()
+            for client in self.clients:
+                client.enqueue(*frame)
+        return len(self.streams) - 1
+
+    def release_payload(self, payload):
+        """One client has sent or dropped a record, the last one gives its memory back to the budget."""
+        with self.holders_lock:
+            remaining = self.holders.get(id(payload))
+            if remaining is None:
+                return  # Not a record, e.g. a description
+            if remaining > 1:
+                self.holders[id(payload)] = remaining - 1
+                return
+            del self.holders[id(payload)]
+        budget.release(self.owner, payload.nbytes)
+
+    def publish(self, stream, record, loop_indices, timestamp_ns):
+        """Queue a record for every connected client. Never blocks on a client or on the memory budget."""
+        sequence = self.sequences[stream]
+        self.sequences[stream] += 1
+        if not self.clients:
+            return
+        record = np.asarray(record)
+        indices = np.asarray(loop_indices, dtype=np.int64)
+        header = FRAME.pack(MAGIC, RECORD, len(indices), 0, stream, sequence, timestamp_ns,
+                            indices.nbytes + record.nbytes) + indices.tobytes()
+        # Larger than the whole budget would never fit, reserve() refuses it outright
+        fits = budget.limit is None or record.nbytes <= budget.limit
+        with self.lock:
+            if not self.clients or not fits or not budget.reserve(self.owner, record.nbytes, timeout=0):
+                self.skipped += bool(self.clients)
+                return
+            # One copy, since the caller reuses its buffer, shared by every client's queue
+            payload = np.ascontiguousarray(record).copy()
+            with self.holders_lock:
+                self.holders[id(payload)] = len(self.clients)
+            for client in self.clients:
+                client.enqueue(header, payload)
+
+    def close(self):
+        """Release one user. The last one disconnects the clients and stops listening."""
+        self.users -= 1
+        if self.users > 0:
+            return
+        self.running = False
+        self.acceptor.join()
+        self.listener.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+        for client in clients:
+            client.thread.join(timeout=2)
+            if client.thread.is_alive():
+                # A client that stopped reading would block its sender forever
+                try:
+                    client.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self.listener.family == getattr(socket, "AF_UNIX", None) and os.path.exists(self.target):
+            os.remove(self.target)
+        del StreamServer.open_servers[self.address]
+        if self.skipped:
+            print(f"{self.skipped} records were not streamed on {self.address}, the memory budget was full.")
+        print(f"Stream server {self.address} closed.")
+
+
+def receive_exactly(sock, nbytes):
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < nbytes:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise EOFError("stream closed")
+        received += count
+    return buffer
+
+
+def read_frames(address):
+    """
+    Connect to a stream server and yield (stream description, sequence, timestamp_ns, loop indices, record) for
+    every record, until the server closes the connection.
+    """
+    family, target = parse_address(address)
+    streams = {}
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(target)
+        while True:
+            try:
+                magic, kind, depth, _, stream, sequence, timestamp_ns, length = \
+                    FRAME.unpack(receive_exactly(sock, FRAME.size))
+                body = receive_exactly(sock, length)
+            except EOFError:
+                return
+            if magic != MAGIC:
+                raise ValueError(f"{address} is not a pyScan stream.")
+            if kind == DESCRIPTION:
+                streams = {entry["id"]: entry for entry in json.loads(bytes(body))["streams"]}
+            elif kind == RECORD:
+                description = streams[stream]
+                loop_indices = np.frombuffer(body, dtype=np.int64, count=depth).tolist()
+                record = np.frombuffer(body, dtype=np.dtype(description["dtype"]), offset=8 * depth)
+                yield description, sequence, timestamp_ns, loop_indices, record.reshape(description["shape"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch records streamed by a running pyScan.")
+    parser.add_argument("address", type=str, nargs="?", default=DEFAULT_ADDRESS,
+                        help=f"Stream address (default {DEFAULT_ADDRESS}).")
+    args = parser.parse_args()
+
+    expected = {}
+    missed = 0
+    try:
+        for description, sequence, timestamp_ns, loop_indices, record in read_frames(args.address):
+            missed += sequence - expected.get(description["id"], sequence)
+            expected[description["id"]] = sequence + 1
+            means = ", ".join(f"{np.mean(channel):.6f}" for channel in record)
+            print(f"{description['path']} #{sequence} {loop_indices} t={timestamp_ns}: mean {means} V "
+                  f"(missed {missed})")
+    except KeyboardInterrupt:
+        pass
+    except ConnectionRefusedError:
+        print(f"Nothing is streaming on {args.address}.")
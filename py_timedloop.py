@@ -0,0 +1,158 @@
+"""
+Timed loop action: runs its child actions at a fixed cadence.
+
+Iteration k is scheduled at start + k * period on time.monotonic_ns, so the time taken by the children does not
+accumulate into drift. Waiting is done with sleep_until (sleep, then spin for the last part) for sub-millisecond
+accuracy.
+
+Supported parameters:
+    period 50 ms                # value and optional unit, one of us/ms/s/min/h (default s)
+    iterations 1000             # number of iterations, or
+    duration 2 h                # total duration, same units as period
+    spin 1 ms                   # time spent busy-waiting before each deadline
+    overrun [skip]/catchup      # after an overrun, skip to the next free slot or run late iterations back to back
+
+Per-iteration lateness (ns after the scheduled start) is saved as int64 to <confile>_<tag>_lateness.bin and a
+summary of lateness and overruns goes into the run metadata.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from py_common import Action, Param, sleep_until
+
+UNITS_NS = {"us": 1_000, "ms": 1_000_000, "s": 1_000_000_000, "min": 60_000_000_000, "h": 3_600_000_000_000}
+
+
+def parse_time_ns(value, default_unit="s"):
+    """Convert a parameter such as '50' or ['50', 'ms'] to integer nanoseconds."""
+    if isinstance(value, str):
+        value = [value]
+    unit = value[1] if len(value) > 1 else default_unit
+    if unit not in UNITS_NS:
+        raise ValueError(f"Unknown time unit '{unit}', use one of {list(UNITS_NS)}.")
+    return int(float(value[0]) * UNITS_NS[unit])
+
+
+class timedloop(Action):
+    PARAMETERS = {
+        "period": Param(parse_time_ns, nargs="+", required=True),
+        "iterations": Param(int),
+        "duration": Param(parse_time_ns, nargs="+"),
+        "spin": Param(parse_time_ns, 1_000_000, nargs="+"),
+        "overrun": Param(str, "skip", choices=["skip", "catchup"]),
+    }
+
+    def __init__(self, filebase):
+        super().__init__(filebase)
+        self.parent = None
+        self.loop_index = 0
+        self.period_ns = 0
+        self.iteration_count = 0
+        self.spin_ns = 1_000_000
+        self.skip_overruns = True
+        self.lateness_file = None
+        # Totals over every run of this loop
+        self.executed = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lateness_sum = 0
+        self.lateness_sq_sum = 0
+        self.lateness_max = 0
+
+    def check_parameters(self):
+        if self.params.period <= 0:
+            raise ValueError("period must be positive")
+        if (self.params.iterations is None) == (self.params.duration is None):
+            raise ValueError("give either 'iterations' or 'duration'")
+
+    def iterations(self):
+        """Scheduled iterations, fewer may run if overruns skip slots."""
+        if self.params.iterations is not None:
+            return self.params.iterations
+        return self.params.duration // self.params.period
+
+    def setup(self):
+        """Work out the period and length of the loop."""
+        super().setup()
+        self.period_ns = self.params.period
+        self.iteration_count = self.iterations()
+        self.spin_ns = self.params.spin
+        self.skip_overruns = self.params.overrun == "skip"
+
+        filename = f"{self.confile_name}_{self.file_tag()}_lateness.bin"
+        if os.path.exists(filename):
+            raise FileExistsError(f"File {filename} already exists. Please remove it or change configuration.")
+        self.lateness_file = open(filename, 'wb')
+        print(f"Timed loop set to {self.iteration_count} iterations every {self.period_ns / 1e6} ms, "
+              f"lateness saved to {filename}.")
+
+    def run(self):
+        """Run the children once per period, recording how late each iteration started."""
+        if not self.child_actions:
+            print("Timed loop has no child actions to repeat.")
+            return
+
+        lateness = np.zeros(self.iteration_count, dtype=np.int64)
+        overruns = 0
+        skipped = 0
+        executed = 0
+        start = time.monotonic_ns()
+        end = start + self.iteration_count * self.period_ns
+        deadline = start
+
+        while executed < self.iteration_count and (deadline < end or not self.skip_overruns):
+            sleep_until(deadline, self.spin_ns)
+            lateness[executed] = time.monotonic_ns() - deadline
+            self.loop_index = executed
+            self.run_children()
+            executed += 1
+
+            deadline += self.period_ns
+            finished = time.monotonic_ns()
+            if finished > deadline:
+                overruns += 1
+                if self.skip_overruns:
+                    # Keep to the original grid, dropping the slots that have already passed
+                    missed = (finished - deadline) // self.period_ns + 1
+                    deadline += missed * self.period_ns
+                    skipped += missed
+
+        lateness = lateness[:executed]
+        lateness.tofile(self.lateness_file)
+        self.executed += executed
+        self.overruns += overruns
+        self.skipped += skipped
+        if executed:
+            self.lateness_sum += int(lateness.sum())
+            self.lateness_sq_sum += int((lateness.astype(np.float64) ** 2).sum())
+            self.lateness_max = max(self.lateness_max, int(lateness.max()))
+            print(f"Timed loop: {executed} iterations in {(time.monotonic_ns() - start) / 1e9:.3f} s, "
+                  f"lateness mean {lateness.mean() / 1e3:.1f} us, max {lateness.max() / 1e3:.1f} us, "
+                  f"{overruns} overruns, {skipped} slots skipped.")
+        self.record_metadata()
+
+    def record_metadata(self):
+        """Summarise the timing of all runs so far into the run metadata."""
+        mean = self.lateness_sum / self.executed if self.executed else 0.0
+        variance = self.lateness_sq_sum / self.executed - mean ** 2 if self.executed else 0.0
+        self.metadata.update({
+            "period_ns": self.period_ns,
+            "iterations_per_run": self.iteration_count,
+            "iterations_executed": self.executed,
+            "overruns": self.overruns,
+            "slots_skipped": self.skipped,
+            "lateness_mean_ns": mean,
+            "lateness_std_ns": max(variance, 0.0) ** 0.5,
+            "lateness_max_ns": self.lateness_max,
+            "lateness_file": self.lateness_file.name,
+        })
+
+    def cleanup(self):
+        """Close the lateness file."""
+        if self.lateness_file is not None:
+            self.lateness_file.close()
+        super().cleanup()
+        print("Timed loop cleanup complete.")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    """Every test writes its data files to its own directory and keeps the action registry cache there too."""
+    import py_registry
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(py_registry, "REGISTRY_FILE", str(tmp_path / "registry.json"))
+
+
+@pytest.fixture
+def run_confile(tmp_path):
+    """Write a .con file and return a parsed, validated ActionParser for it."""
+    from pyScan import ActionParser
+
+    def parse(text, name="test.con"):
+        (tmp_path / name).write_text(text)
+        action_parser = ActionParser(name)
+        action_parser.parse()
+        assert action_parser.validate() == []
+        return action_parser
+
+    return parse
+
+
+@pytest.fixture
+def fake_nidaqmx(monkeypatch):
+    """Run A2D actions against the fake DAQ in fake_nidaqmx.py, returns its FakeTask class."""
+    import fake_nidaqmx
+    return fake_nidaqmx.install(monkeypatch)
@@ -0,0 +1,83 @@
+"""Stand-in for the nidaqmx package, enough for A2D to acquire without a DAQ card."""
+
+import sys
+import types
+
+import numpy as np
+
+
+def channel_code(name):
+    """Value the fake DAQ returns for a channel, e.g. Dev2/ai1 -> 21."""
+    device, channel = name.split("/")
+    return 10 * int(device[3:]) + int(channel[2:])
+
+
+class FakeTask:
+    created = []
+    events = []
+
+    def __init__(self):
+        self.channels = []
+        self.clock_source = None
+        self.trigger_source = None
+        self.events = FakeTask.events
+        self.ai_channels = types.SimpleNamespace(add_ai_voltage_chan=self.add_channel)
+        self.timing = types.SimpleNamespace(cfg_samp_clk_timing=self.configure_clock)
+        self.triggers = types.SimpleNamespace(
+            start_trigger=types.SimpleNamespace(cfg_dig_edge_start_trig=self.configure_trigger))
+        self.in_stream = self
+        self.position = 0
+        FakeTask.created.append(self)
+
+    def add_channel(self, name, **kwargs):
+        self.channels.append(name)
+
+    def configure_clock(self, rate, sample_mode, samps_per_chan, source=None):
+        self.clock_source = source
+
+    def configure_trigger(self, source):
+        self.trigger_source = source
+
+    def start(self):
+        self.position = 0
+        self.events.append(("start", self.channels[0].split("/")[0]))
+
+    def stop(self):
+        self.events.append(("stop", self.channels[0].split("/")[0]))
+
+    def close(self):
+        self.events.append(("close", self.channels[0].split("/")[0]))
+
+
+class FakeReader:
+    fail = False
+
+    def __init__(self, task):
+        self.task = task
+
+    def read_many_sample(self, buffer, number_of_samples_per_channel, timeout):
+        if FakeReader.fail:
+            raise RuntimeError("read timed out")
+        samples = np.arange(self.task.position, self.task.position + number_of_samples_per_channel)
+        for row, name in enumerate(self.task.channels):
+            buffer[row] = channel_code(name) + samples / 1e6
+        self.task.position += number_of_samples_per_channel
+
+
+def install(monkeypatch):
+    """Make `import nidaqmx` give the fake for the rest of the test."""
+    FakeTask.created = []
+    FakeTask.events = []
+    FakeReader.fail = False
+    nidaqmx = types.ModuleType("nidaqmx")
+    nidaqmx.Task = FakeTask
+    nidaqmx.DaqError = type("DaqError", (Exception,), {})
+    constants = types.ModuleType("nidaqmx.constants")
+    constants.AcquisitionType = types.SimpleNamespace(FINITE="finite")
+    constants.TerminalConfiguration = types.SimpleNamespace(DEFAULT="default")
+    stream_readers = types.ModuleType("nidaqmx.stream_readers")
+    stream_readers.AnalogMultiChannelReader = FakeReader
+    monkeypatch.setitem(sys.modules, "nidaqmx", nidaqmx)
+    monkeypatch.setitem(sys.modules, "nidaqmx.constants", constants)
+    monkeypatch.setitem(sys.modules, "nidaqmx.stream_readers", stream_readers)
+    return FakeTask
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from fake_nidaqmx import FakeReader, channel_code
+from pyScan import run_configuration
+
+
+CONFIG = """
+action count
+count 2
+action A2D
+    channels Dev1/ai0 Dev2/ai0 Dev1/ai1
+    samples {samples}
+    rate 100000
+end
+end
+"""
+
+
+def test_one_task_per_device_slaved_to_the_master(fake_nidaqmx, run_confile):
+    run_configuration(run_confile(CONFIG.format(samples=25000)))
+
+    master, slave = fake_nidaqmx.created
+    assert master.channels == ["Dev1/ai0", "Dev1/ai1"]
+    assert slave.channels == ["Dev2/ai0"]
+    assert master.clock_source is None and master.trigger_source is None
+    assert slave.clock_source == "/Dev1/ai/SampleClock"
+    assert slave.trigger_source == "/Dev1/ai/StartTrigger"
+    # Every record arms the slave before starting the master
+    starts = [device for event, device in fake_nidaqmx.events if event == "start"]
+    assert starts == ["Dev2", "Dev1"] * 2
+    assert ("close", "Dev1") in fake_nidaqmx.events and ("close", "Dev2") in fake_nidaqmx.events
+
+
+def test_records_keep_the_channel_order_of_the_con_file(fake_nidaqmx, run_confile):
+    samples = 25000  # More than one read chunk, so the chunked path is used
+    run_configuration(run_confile(CONFIG.format(samples=samples)))
+
+    expected = np.arange(samples) / 1e6
+    for channel in ["Dev1/ai0", "Dev2/ai0", "Dev1/ai1"]:
+        records = np.fromfile(f"test_channel{channel.replace('/', '_')}.bin").reshape(2, samples)
+        np.testing.assert_allclose(records, np.broadcast_to(channel_code(channel) + expected, (2, samples)))
+
+
+def test_failed_read_is_raised_and_nothing_is_saved(fake_nidaqmx, run_confile):
+    action_parser = run_confile(CONFIG.format(samples=100))
+    FakeReader.fail = True
+    with pytest.raises(RuntimeError, match="read timed out"):
+        run_configuration(action_parser)
+    assert np.fromfile("test_channelDev1_ai0.bin").size == 0
+    # The tasks were still stopped and closed
+    assert ("stop", "Dev1") in fake_nidaqmx.events and ("close", "Dev1") in fake_nidaqmx.events
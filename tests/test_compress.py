@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import py_compress
+from py_memory import MemoryBudget
+from py_compress import CompressedReader, CompressedWriter, load_codec, shuffle, unshuffle
+
+
+def signal(record, channels=2, samples=1000):
+    """Slowly varying test data, different for every record and channel."""
+    t = np.arange(samples) / samples
+    return np.array([np.sin(2 * np.pi * (record + 1) * t) + channel for channel in range(channels)])
+
+
+def test_shuffle_round_trip():
+    samples = np.random.default_rng(0).normal(size=333)
+    assert np.array_equal(unshuffle(shuffle(samples), samples.dtype), samples)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lz4", "zstd"])
+@pytest.mark.parametrize("chunk_samples", [128, 300, 1000, 5000])
+def test_round_trip(codec, chunk_samples):
+    if codec != "zlib":
+        pytest.importorskip({"lz4": "lz4.block", "zstd": "zstandard"}[codec])
+    writer = CompressedWriter("run.pyscanz", ["ai0", "ai1"], 1000, chunk_samples=chunk_samples, codec=codec,
+                              threads=3, path="A2D[0]")
+    for record in range(6):
+        writer.write_record(signal(record))
+    writer.close()
+
+    reader = CompressedReader("run.pyscanz")
+    assert reader.records == 6
+    assert reader.metadata["path"] == "A2D[0]"
+    for record in range(6):
+        np.testing.assert_array_equal(reader.read(record), signal(record))
+    np.testing.assert_array_equal(reader.read(4, channel=1), signal(4)[1])
+    with pytest.raises(KeyError):
+        reader.read(6)
+
+
+def test_record_buffer_may_be_reused():
+    writer = CompressedWriter("run.pyscanz", ["ai0"], 500, chunk_samples=100)
+    buffer = np.empty((1, 500))
+    for record in range(4):
+        buffer[...] = record
+        writer.write_record(buffer)
+    writer.close()
+    reader = CompressedReader("run.pyscanz")
+    assert [reader.read(record)[0, 0] for record in range(4)] == [0, 1, 2, 3]
+
+
+def test_refuses_to_overwrite():
+    CompressedWriter("run.pyscanz", ["ai0"], 10).close()
+    with pytest.raises(FileExistsError):
+        CompressedWriter("run.pyscanz", ["ai0"], 10)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown codec"):
+        load_codec("gzip")
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_queued_records_stay_within_the_budget(monkeypatch, tmp_path, spill):
+    budget = MemoryBudget(limit=3 * 16000, spill=spill, spill_dir=str(tmp_path))
+    monkeypatch.setattr(py_compress, "budget", budget)
+    writer = CompressedWriter("run.pyscanz", ["ai0", "ai1"], 1000, chunk_samples=100)
+    for record in range(10):
+        writer.write_record(signal(record))
+        assert budget.used <= budget.limit
+    writer.close()
+    assert budget.used == 0
+    assert budget.peak <= budget.limit
+    assert not list(tmp_path.glob("*.spill"))
+    reader = CompressedReader("run.pyscanz")
+    np.testing.assert_array_equal(reader.read(9), signal(9))
+
+
+def test_record_larger_than_the_budget(monkeypatch, tmp_path):
+    budget = MemoryBudget(limit=8000, spill_dir=str(tmp_path))
+    monkeypatch.setattr(py_compress, "budget", budget)
+    writer = CompressedWriter("run.pyscanz", ["ai0", "ai1"], 1000)
+    with pytest.raises(MemoryError, match="more than the whole memory budget"):
+        writer.write_record(signal(0))
+    # With spilling the record is queued from a file on disk instead
+    budget.spill = True
+    writer.write_record(signal(0))
+    writer.close()
+    assert budget.spilled == 16000 and budget.used == 0
+    assert not list(tmp_path.glob("*.spill"))
+    np.testing.assert_array_equal(CompressedReader("run.pyscanz").read(0), signal(0))
+
+
+def crash(writer):
+    """Leave the file as a killed process would, after everything written so far reached the disk."""
+    while writer.pending:
+        writer.pending[0][4].result()
+        writer.drain()
+    writer.pool.shutdown()
+    writer.file.close()
+
+
+def test_unfinished_file_is_recovered():
+    writer = CompressedWriter("crash.pyscanz", ["ai0", "ai1"], 1000, chunk_samples=300)
+    for record in range(5):
+        writer.write_record(signal(record))
+    crash(writer)
+    reader = CompressedReader("crash.pyscanz")
+    assert reader.records == 5
+    np.testing.assert_array_equal(reader.read(4), signal(4))
+
+
+def test_recovery_drops_a_partly_written_record():
+    writer = CompressedWriter("cut.pyscanz", ["ai0", "ai1"], 1000, chunk_samples=300)
+    for record in range(5):
+        writer.write_record(signal(record))
+    crash(writer)
+    last = writer.table[writer.count - 1]
+    with open("cut.pyscanz", "r+b") as file:
+        file.truncate(int(last["offset"]) + int(last["length"]) // 2)
+    reader = CompressedReader("cut.pyscanz")
+    assert reader.records == 4
+    np.testing.assert_array_equal(reader.read(3), signal(3))
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from py_container import ALIGNMENT, FLUSH_RECORDS, ContainerReader, ContainerWriter
+
+
+class Source:
+    """Stands in for an action writing to the container."""
+
+    def __init__(self, path, depth=1):
+        self.path = path
+        self.parent = None
+        self.depth = depth
+
+    def loop_indices(self):
+        return [0] * self.depth
+
+    def describe(self):
+        return {"action": "Source", "path": self.path}
+
+
+def write(filename, records, close=True):
+    writer = ContainerWriter.open(filename)
+    fast = writer.add_stream(Source("A2D[0]"), np.float64, (50, 3), channels=["ai0", "ai1", "ai2"])
+    slow = writer.add_stream(Source("A2D[1]"), np.int16, (7,))
+    for i in range(records):
+        writer.write_record(fast, np.full((50, 3), i, dtype=np.float64), [i], 1000 + i)
+        writer.write_record(slow, np.arange(7, dtype=np.int16) + i, [i], 2000 + i)
+    if close:
+        writer.close()
+    else:
+        writer.file.flush()
+        ContainerWriter.open_writers.pop(filename)  # As if the process died here
+    return writer
+
+
+def test_round_trip():
+    write("run.pyscan", 5)
+    reader = ContainerReader("run.pyscan")
+    assert [stream["path"] for stream in reader.streams] == ["A2D[0]", "A2D[1]"]
+    assert reader.streams[0]["channels"] == ["ai0", "ai1", "ai2"]
+    for i in range(5):
+        np.testing.assert_array_equal(reader.read("A2D[0]", [i]), np.full((50, 3), i))
+        np.testing.assert_array_equal(reader.read("A2D[1]", [i]), np.arange(7) + i)
+    entries = reader.entries("A2D[1]")
+    assert list(entries["timestamp_ns"]) == [2000 + i for i in range(5)]
+    assert all(int(offset) % ALIGNMENT == 0 for offset in reader.index["offset"])
+    with pytest.raises(KeyError):
+        reader.read("A2D[0]", [5])
+
+
+def test_refuses_to_overwrite():
+    write("run.pyscan", 1)
+    with pytest.raises(FileExistsError):
+        ContainerWriter.open("run.pyscan")
+
+
+def test_shared_writer_closes_with_its_last_user():
+    first = ContainerWriter.open("shared.pyscan")
+    assert ContainerWriter.open("shared.pyscan") is first
+    first.close()
+    assert "shared.pyscan" in ContainerWriter.open_writers
+    first.close()
+    assert "shared.pyscan" not in ContainerWriter.open_writers
+
+
+def test_unfinished_file_is_recovered():
+    records = FLUSH_RECORDS + 3
+    writer = write("crash.pyscan", records, close=False)
+    reader = ContainerReader("crash.pyscan")
+    assert len(reader.index) == 2 * records
+    np.testing.assert_array_equal(reader.read("A2D[0]", [records - 1]), np.full((50, 3), records - 1))
+    writer.file.close()
+
+
+def test_recovery_stops_at_a_cut_off_record():
+    writer = write("cut.pyscan", 4, close=False)
+    writer.file.close()
+    last = writer.index[writer.count - 1]
+    with open("cut.pyscan", "r+b") as file:
+        file.truncate(int(last["offset"]) + int(last["length"]) // 2)
+    reader = ContainerReader("cut.pyscan")
+    assert len(reader.index) == 7  # The last record of A2D[1] is incomplete
+    np.testing.assert_array_equal(reader.read("A2D[0]", [3]), np.full((50, 3), 3))
+    with pytest.raises(KeyError):
+        reader.read("A2D[1]", [3])
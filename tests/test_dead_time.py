@@ -0,0 +1,110 @@
+import types
+
+import numpy as np
+import pytest
+
+from py_a2d import A2D, MISSING_TIMESTAMP, DeadTimeStats
+
+RECORD_NS = 1_000_000
+
+
+def stats_for(dead_times):
+    """DeadTimeStats after records separated by the given dead times."""
+    stats = DeadTimeStats(RECORD_NS)
+    start = 5_000_000
+    stats.add(start)
+    for dead in dead_times:
+        start += RECORD_NS + dead
+        stats.add(start)
+    return stats
+
+
+def test_summary():
+    summary = stats_for([1000, 2000, 3000, 6000]).summary()
+    assert summary["records"] == 5
+    assert summary["missing_timestamps"] == 0
+    assert summary["dead_time_mean_ns"] == 3000
+    assert summary["dead_time_std_ns"] == pytest.approx(np.std([1000, 2000, 3000, 6000]))
+    assert summary["dead_time_min_ns"] == 1000
+    assert summary["dead_time_max_ns"] == 6000
+    assert summary["efficiency"] == pytest.approx(5 * RECORD_NS / (5 * RECORD_NS + 12000))
+
+
+def test_percentiles_are_upper_bin_edges():
+    dead_times = [150] * 90 + [20_000] * 9 + [5_000_000]
+    stats = stats_for(dead_times)
+    edges = DeadTimeStats.BIN_EDGES
+    median = stats.percentile(50)
+    assert median >= 150 and median == edges[np.searchsorted(edges, 150)]
+    # Less than one bin (a factor 10**0.1) above the true value
+    assert median / 150 < 10 ** 0.1
+    assert 20_000 <= stats.percentile(99) < 20_000 * 10 ** 0.1
+
+
+def test_percentiles_never_exceed_the_maximum():
+    stats = stats_for([150, 150, 150])
+    assert stats.percentile(50) == 150
+    assert stats.percentile(100) == 150
+
+
+def test_dead_time_beyond_the_histogram():
+    stats = stats_for([10, 500 * 10 ** 9])
+    assert stats.summary()["dead_time_max_ns"] == 500 * 10 ** 9
+    assert stats.percentile(99) == DeadTimeStats.BIN_EDGES[-1]
+
+
+def test_no_gaps_across_missing_start_times():
+    stats = DeadTimeStats(RECORD_NS)
+    stats.add(0)
+    stats.add_missing()
+    stats.add(5 * RECORD_NS)  # Not a gap of 4 records: the missing record lies somewhere in between
+    stats.add(6 * RECORD_NS + 100)
+    summary = stats.summary()
+    assert summary["records"] == 4
+    assert summary["missing_timestamps"] == 1
+    assert stats.gaps == 1
+    assert summary["dead_time_mean_ns"] == 100
+
+
+def test_summary_without_gaps():
+    stats = DeadTimeStats(RECORD_NS)
+    stats.add_missing()
+    stats.add_missing()
+    assert stats.summary() == {"records": 2, "missing_timestamps": 2}
+
+
+def recorder(tmp_path, hardware_times):
+    """A2D stand-in for save_timestamp, whose DAQ reports the given start times (None when reading fails)."""
+    times = iter(hardware_times)
+    return types.SimpleNamespace(
+        hardware_timestamps=True,
+        timestamp_clock=None,
+        hardware_start_ns=lambda: next(times),
+        timestamp_file=open(tmp_path / "timestamps.bin", "wb"),
+        timestamp_row=np.zeros(2, dtype=np.int64),
+        loop_indices=lambda: [7],
+        dead_time=DeadTimeStats(RECORD_NS),
+    )
+
+
+def test_daq_clock_is_kept_when_its_start_time_fails(tmp_path):
+    a2d = recorder(tmp_path, [10 * RECORD_NS, None, 14 * RECORD_NS])
+    for perf_counter_ns in [1, 2, 3]:
+        A2D.save_timestamp(a2d, perf_counter_ns)
+    a2d.timestamp_file.close()
+    assert a2d.timestamp_clock == "daq"
+    rows = np.fromfile(tmp_path / "timestamps.bin", dtype=np.int64).reshape(-1, 2)
+    assert list(rows[:, 0]) == [10 * RECORD_NS, MISSING_TIMESTAMP, 14 * RECORD_NS]
+    assert list(rows[:, 1]) == [7, 7, 7]
+    assert a2d.dead_time.missing == 1 and a2d.dead_time.gaps == 0
+
+
+def test_perf_counter_clock_when_the_daq_cannot_tell(tmp_path):
+    a2d = recorder(tmp_path, [None])
+    for perf_counter_ns in [0, RECORD_NS + 50, 2 * RECORD_NS + 150]:
+        A2D.save_timestamp(a2d, perf_counter_ns)
+    a2d.timestamp_file.close()
+    assert a2d.timestamp_clock == "perf_counter"
+    rows = np.fromfile(tmp_path / "timestamps.bin", dtype=np.int64).reshape(-1, 2)
+    assert list(rows[:, 0]) == [0, RECORD_NS + 50, 2 * RECORD_NS + 150]
+    assert a2d.dead_time.summary()["dead_time_mean_ns"] == 75
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import py_actor
+from py_actor import ActorProxy, share_budget
+from py_memory import MemoryBudget, parse_size
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("512", 512),
+    ("4GB", 4 * 2 ** 30),
+    ("4 gb", 4 * 2 ** 30),
+    ("4G", 4 * 2 ** 30),
+    (["1.5", "MB"], 3 * 2 ** 19),
+    ("64kb", 64 * 2 ** 10),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["GB", "4 PB", "lots"])
+def test_parse_size_errors(value):
+    with pytest.raises(ValueError, match="as a size"):
+        parse_size(value)
+
+
+def test_reserve_times_out_when_full():
+    budget = MemoryBudget(limit=1000)
+    assert budget.reserve("A2D[0]", 600, timeout=0)
+    assert not budget.reserve("A2D[1]", 600, timeout=0.01)
+    assert budget.used == 600
+    assert budget.by_owner == {"A2D[0]": 600}
+
+
+def test_reserve_waits_for_a_release():
+    budget = MemoryBudget(limit=1000)
+    budget.reserve("consumer", 800)
+    releaser = threading.Timer(0.05, budget.release, ("consumer", 800))
+    releaser.start()
+    started = time.perf_counter()
+    assert budget.reserve("producer", 800, timeout=5)
+    releaser.join()
+    assert time.perf_counter() - started >= 0.04
+    assert budget.waited_ns > 0
+    assert budget.used == 800 and budget.peak == 800
+
+
+def test_reserve_more_than_the_limit_raises():
+    budget = MemoryBudget(limit=1000)
+    with pytest.raises(MemoryError, match="more than the whole memory budget"):
+        budget.reserve("A2D[0]", 1001)
+
+
+def test_allocate_fails_naming_the_holders():
+    budget = MemoryBudget(limit=1000)
+    kept = budget.allocate("Camera[0]", (100,), np.float64)
+    assert budget.used == 800
+    with pytest.raises(MemoryError, match="Camera\\[0\\] 800 B"):
+        budget.allocate("A2D[0]", (50,), np.float64)
+    budget.free(kept)
+    assert budget.used == 0
+    assert budget.allocate("A2D[0]", (50,), np.float64).shape == (50,)
+
+
+def test_allocate_spills_to_disk(tmp_path):
+    budget = MemoryBudget(limit=1000, spill=True, spill_dir=str(tmp_path))
+    array = budget.allocate("A2D[0]", (10, 20), np.float64)
+    assert isinstance(array, np.memmap)
+    assert budget.used == 0 and budget.spilled == 1600
+    array[...] = 1.0
+    assert len(list(tmp_path.glob("pyScan_A2D_0__*.spill"))) == 1
+    budget.free(array)
+    assert list(tmp_path.glob("*.spill")) == []
+
+
+def test_no_limit_still_tracks_usage():
+    budget = MemoryBudget()
+    budget.reserve("A2D[0]", 10 ** 12)
+    budget.release("A2D[0]", 10 ** 12)
+    assert budget.used == 0 and budget.peak == 10 ** 12
+
+
+def test_claim():
+    budget = MemoryBudget(limit=1000)
+    budget.claim("A2D[0] monitor", 700)
+    with pytest.raises(MemoryError, match="A2D\\[1\\] monitor needs 400 B but only 300 B"):
+        budget.claim("A2D[1] monitor", 400)
+    budget.release("A2D[0] monitor", 700)
+    budget.claim("A2D[1] monitor", 400)
+    assert budget.by_owner == {"A2D[0] monitor": 0, "A2D[1] monitor": 400}
+
+
+def test_report_and_reset(capsys):
+    budget = MemoryBudget(limit=2 ** 20)
+    budget.reserve("A2D[0]", 2 ** 19)
+    budget.reserve("Camera[0]", 2 ** 18)
+    budget.release("A2D[0]", 2 ** 19)
+    summary = budget.report()
+    assert summary["limit_bytes"] == 2 ** 20
+    assert summary["peak_bytes"] == 2 ** 19 + 2 ** 18
+    assert summary["peak_bytes_by_owner"] == {"A2D[0]": 2 ** 19, "Camera[0]": 2 ** 18}
+    assert "Peak buffer memory 768.0 kB of 1.0 MB" in capsys.readouterr().out
+    # The next configuration starts from what is still held
+    budget.reset()
+    assert budget.summary()["peak_bytes"] == 2 ** 18
+    assert budget.summary()["peak_bytes_by_owner"] == {"Camera[0]": 2 ** 18}
+
+
+def worker(path):
+    proxy = ActorProxy.__new__(ActorProxy)
+    proxy.budget_owner = f"{path} worker"
+    proxy.memory_share = None
+    return proxy
+
+
+def test_workers_get_equal_shares(monkeypatch):
+    budget = MemoryBudget(limit=3000)
+    monkeypatch.setattr(py_actor, "budget", budget)
+    first, second = worker("A2D[0]"), worker("Camera[0]")
+    loop = types.SimpleNamespace(child_actions=[first, types.SimpleNamespace(child_actions=[second])])
+    share_budget([loop])
+    assert first.memory_share == second.memory_share == 1000
+    assert budget.used == 2000
+    # What is left is this process's own share
+    with pytest.raises(MemoryError):
+        budget.claim("A2D[1] monitor", 1001)
+
+
+def test_no_shares_without_a_limit(monkeypatch):
+    monkeypatch.setattr(py_actor, "budget", MemoryBudget())
+    proxy = worker("A2D[0]")
+    share_budget([proxy])
+    assert proxy.memory_share is None
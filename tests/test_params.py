@@ -0,0 +1,86 @@
+import pytest
+
+from py_common import Action, Param, boolean, floats, words
+
+
+# Raw values as Action.parse_line stores them: absent is None, one word a string, otherwise a list
+@pytest.mark.parametrize("param, raw, expected", [
+    (Param(int, 5), None, 5),
+    (Param(int, 5), "7", 7),
+    (Param(str, "relative", choices=["relative", "absolute"]), "Absolute", "absolute"),
+    (Param(nargs=0), None, False),
+    (Param(nargs=0), [], True),
+    (Param(boolean, False, nargs="?"), None, False),
+    (Param(boolean, False, nargs="?"), [], True),
+    (Param(boolean, False, nargs="?"), "false", False),
+    (Param(boolean, False, nargs="?"), "yes", True),
+    (Param(floats, nargs=3), ["0", "0.5", "2"], [0.0, 0.5, 2.0]),
+    (Param(words, nargs="+"), "ai0", ["ai0"]),
+    (Param(words, nargs="+"), ["ai0", "Dev2/ai1"], ["ai0", "Dev2/ai1"]),
+    (Param(words, ["mean"], nargs="+"), None, ["mean"]),
+])
+def test_compile(param, raw, expected):
+    assert param.compile("key", raw) == expected
+
+
+@pytest.mark.parametrize("param, raw, message", [
+    (Param(int, required=True), None, "missing required parameter 'key'"),
+    (Param(int), "seven", "invalid value for 'key'"),
+    (Param(int), [], "'key' takes 1 value"),
+    (Param(int), ["1", "2"], "'key' takes 1 value"),
+    (Param(nargs=0), "true", "'key' is a flag"),
+    (Param(boolean, False, nargs="?"), ["true", "false"], "'key' takes at most one value"),
+    (Param(boolean, False, nargs="?"), "maybe", "expected true or false"),
+    (Param(floats, nargs=3), ["0", "1"], "'key' takes 3 value"),
+    (Param(words, nargs="+"), [], "'key' needs at least one value"),
+    (Param(str, choices=["bin", "container"]), "hdf5", "'key' must be one of"),
+])
+def test_compile_errors(param, raw, message):
+    with pytest.raises(ValueError, match=message):
+        param.compile("key", raw)
+
+
+class Example(Action):
+    PARAMETERS = {
+        "samples": Param(int, 1000),
+        "scan": Param(floats, nargs=3, required=True),
+    }
+
+    def check_parameters(self):
+        if self.params.samples <= 0:
+            raise ValueError("samples must be positive")
+
+
+def compiled(*lines):
+    action = Example("test")
+    for line in lines:
+        action.parse_line(line.split())
+    action.compile_parameters()
+    return action.params
+
+
+def test_compile_parameters_fills_defaults_including_inherited():
+    params = compiled("scan 0 1 10")
+    assert params.samples == 1000
+    assert params.scan == [0.0, 1.0, 10.0]
+    assert params.process is False  # Declared by Action for every action
+
+
+def test_compile_parameters_reports_every_problem():
+    with pytest.raises(ValueError) as error:
+        compiled("samples many", "colour red")
+    message = str(error.value)
+    assert "unknown parameter 'colour'" in message
+    assert "invalid value for 'samples'" in message
+    assert "missing required parameter 'scan'" in message
+
+
+def test_check_parameters_runs_on_compiled_values():
+    with pytest.raises(ValueError, match="samples must be positive"):
+        compiled("scan 0 1 10", "samples 0")
+
+
+def test_compiled_parameters_are_slotted():
+    params = compiled("scan 0 1 10")
+    with pytest.raises(AttributeError):
+        params.typo = 1
@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+
+from fake_nidaqmx import FakeReader, channel_code
+from py_common import Action
+from py_count import count
+from py_scanmap import scanmap
+from py_stage import Stage1D
+from pyScan import run_configuration
+
+SAMPLES = 100
+
+CONFIG = """
+action count
+count 2
+action count
+    count 3
+    action A2D
+        channels Dev1/ai0 Dev1/ai1
+        samples 100
+        rate 10000
+        action scanmap
+            reduce mean max pp
+        end
+    end
+end
+end
+"""
+
+
+@pytest.fixture
+def numbered_records(fake_nidaqmx, monkeypatch):
+    """Offset every record by 100 times its number, so each map point shows which record landed there."""
+    read = FakeReader.read_many_sample
+
+    def read_numbered(self, buffer, number_of_samples_per_channel, timeout):
+        read(self, buffer, number_of_samples_per_channel, timeout)
+        record = sum(1 for event in fake_nidaqmx.events if event == ("start", "Dev1")) - 1
+        buffer += 100 * record
+
+    monkeypatch.setattr(FakeReader, "read_many_sample", read_numbered)
+
+
+def test_nested_loops_give_the_map_axes(numbered_records, run_confile):
+    run_configuration(run_confile(CONFIG))
+
+    scan_map = np.load("test_count0_count0_A2D0_scanmap0_map.npy")
+    assert scan_map.shape == (2, 3, 2, 3)
+    assert not np.isnan(scan_map).any()
+    ramp = np.arange(SAMPLES) / 1e6
+    for outer in range(2):
+        for inner in range(3):
+            for row, channel in enumerate(["Dev1/ai0", "Dev1/ai1"]):
+                expected = channel_code(channel) + 100 * (3 * outer + inner) + ramp
+                np.testing.assert_allclose(scan_map[outer, inner, row],
+                                           [expected.mean(), expected.max(), np.ptp(expected)])
+
+    with open("test_metadata.json") as file:
+        metadata = json.load(file)["actions"]["count[0]/count[0]/A2D[0]/scanmap[0]"]
+    assert metadata["axes"] == ["count[0]", "count[0]/count[0]", "channel", "reduction"]
+    assert metadata["shape"] == [2, 3, 2, 3]
+    assert metadata["channels"] == ["Dev1/ai0", "Dev1/ai1"]
+    assert metadata["reductions"] == ["mean", "max", "pp"]
+    assert metadata["records"] == 6
+
+
+def test_selected_channels_and_single_iteration_loops(numbered_records, run_confile):
+    config = CONFIG.replace("count 2", "count 1").replace("reduce mean max pp", "reduce rms\n channels Dev1/ai1")
+    run_configuration(run_confile(config))
+
+    scan_map = np.load("test_count0_count0_A2D0_scanmap0_map.npy")
+    assert scan_map.shape == (3, 1, 1)  # A loop running once gives no axis
+    expected = channel_code("Dev1/ai1") + 100 * np.arange(3)[:, None] + np.arange(SAMPLES) / 1e6
+    np.testing.assert_allclose(scan_map[:, 0, 0], np.sqrt((expected ** 2).mean(axis=1)))
+
+
+class Stage(Stage1D):
+    """Stage without hardware."""
+
+    def get_here(self):
+        self.initial_position = 0.0
+
+    def go_to(self, point):
+        pass
+
+
+def action(cls, parent, *lines):
+    """Compiled action of class cls placed under parent."""
+    new = cls("test")
+    new.parent = parent
+    for line in lines:
+        new.parse_line(line.split())
+    new.compile_parameters()
+    return new
+
+
+def test_stages_give_the_map_axes_instead_of_loops():
+    repeat = action(count, None, "count 4")
+    outer = action(Stage, repeat, "scan 0 1 2")
+    inner = action(Stage, outer, "scan 0 0.5 2")
+    acquisition = action(Action, inner)
+    acquisition.data = None  # Stands in for an A2D
+    axes, shape = action(scanmap, acquisition).map_axes()
+    assert axes == [outer, inner]
+    assert shape == [3, 5]
@@ -0,0 +1,87 @@
+import pytest
+
+from py_session import SessionPool
+
+
+class Hardware:
+    """Counts how often sessions are opened and closed."""
+
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+
+    def open(self, name):
+        def open_session():
+            self.opened.append(name)
+            return f"{name} session {len(self.opened)}"
+        return open_session
+
+    def close(self, session):
+        self.closed.append(session)
+
+
+@pytest.fixture
+def hardware():
+    return Hardware()
+
+
+def test_users_of_one_key_share_a_session(hardware):
+    pool = SessionPool()
+    first = pool.acquire("COM3", hardware.open("COM3"), hardware.close)
+    second = pool.acquire("COM3", hardware.open("COM3"), hardware.close)
+    other = pool.acquire("COM4", hardware.open("COM4"), hardware.close)
+    assert first is second
+    assert other != first
+    assert hardware.opened == ["COM3", "COM4"]
+    assert pool.opened == 2 and pool.reused == 0
+
+
+def test_closed_when_the_last_user_releases(hardware):
+    pool = SessionPool()
+    session = pool.acquire("COM3", hardware.open("COM3"), hardware.close)
+    pool.acquire("COM3", hardware.open("COM3"), hardware.close)
+    pool.release("COM3")
+    assert hardware.closed == []
+    pool.release("COM3")
+    assert hardware.closed == [session]
+    assert "COM3" not in pool.sessions
+    pool.release("COM3")  # Releasing again is harmless
+    assert hardware.closed == [session]
+
+
+def test_keep_open_reuses_idle_sessions(hardware):
+    pool = SessionPool()
+    pool.keep_open = True
+    session = pool.acquire("Dev1", hardware.open("Dev1"), hardware.close)
+    pool.release("Dev1")
+    assert hardware.closed == []
+    # The next configuration gets the same session back without reconnecting
+    assert pool.acquire("Dev1", hardware.open("Dev1"), hardware.close) is session
+    assert hardware.opened == ["Dev1"]
+    assert pool.reused == 1
+    pool.release("Dev1")
+    pool.close_all()
+    assert hardware.closed == [session]
+    assert pool.sessions == {}
+
+
+def test_close_all_closes_sessions_in_use(hardware):
+    pool = SessionPool()
+    pool.acquire("COM3", hardware.open("COM3"), hardware.close)
+    pool.acquire("Dev1", hardware.open("Dev1"), hardware.close)
+    pool.close_all()
+    assert sorted(hardware.closed) == ["COM3 session 1", "Dev1 session 2"]
+    assert pool.sessions == {}
+
+
+def test_close_errors_are_reported_and_do_not_stop_close_all(hardware, capsys):
+    def fail(session):
+        raise OSError("port vanished")
+
+    pool = SessionPool()
+    pool.acquire("COM3", hardware.open("COM3"), fail)
+    pool.acquire("Dev1", hardware.open("Dev1"), hardware.close)
+    pool.close_all()
+    assert "Closing session COM3 failed: port vanished" in capsys.readouterr().out
+    assert hardware.closed == ["Dev1 session 2"]
+    assert pool.sessions == {}
@@ -0,0 +1,141 @@
+import socket
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import py_stream
+from py_memory import MemoryBudget
+from py_stream import StreamServer, parse_address, read_frames
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    budget = MemoryBudget()
+    monkeypatch.setattr(py_stream, "budget", budget)
+    return budget
+
+
+@pytest.fixture
+def address(tmp_path):
+    return f"unix:{tmp_path / 'stream.sock'}"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def source(path="A2D[0]"):
+    return types.SimpleNamespace(path=path)
+
+
+def test_parse_address():
+    assert parse_address("tcp:127.0.0.1:5757") == (socket.AF_INET, ("127.0.0.1", 5757))
+    assert parse_address("tcp::6000") == (socket.AF_INET, ("127.0.0.1", 6000))
+    assert parse_address("unix:/tmp/pyscan.sock")[1] == "/tmp/pyscan.sock"
+    with pytest.raises(ValueError, match="should look like"):
+        parse_address("udp:127.0.0.1:5757")
+
+
+def test_client_receives_every_record(budget, address):
+    server = StreamServer.open(address)
+    stream = server.add_stream(source(), np.float64, (2, 100), channels=["ai0", "ai1"])
+    server.publish(stream, np.zeros((2, 100)), [0], 0)  # Nobody is listening yet
+    frames = []
+    reader = threading.Thread(target=lambda: frames.extend(read_frames(address)))
+    reader.start()
+    wait_for(lambda: server.clients)
+    for record in range(1, 21):
+        server.publish(stream, np.full((2, 100), record, dtype=np.float64), [record // 5, record % 5], 1000 * record)
+    server.close()
+    reader.join(timeout=5)
+
+    assert len(frames) == 20
+    for record, (description, sequence, timestamp_ns, loop_indices, data) in enumerate(frames, 1):
+        assert description["path"] == "A2D[0]" and description["channels"] == ["ai0", "ai1"]
+        assert sequence == record
+        assert timestamp_ns == 1000 * record
+        assert loop_indices == [record // 5, record % 5]
+        np.testing.assert_array_equal(data, np.full((2, 100), record))
+    assert budget.used == 0
+    assert address not in StreamServer.open_servers
+
+
+def test_slow_client_gets_drops_without_holding_up_publish(budget, address):
+    server = StreamServer.open(address, queue_length=4)
+    stream = server.add_stream(source(), np.float64, (1, 2 ** 17))
+    record = np.ones((1, 2 ** 17))  # 1 MB, far more than the socket buffers hold
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(parse_address(address)[1])
+    wait_for(lambda: server.clients)
+    client, = server.clients
+
+    started = time.perf_counter()
+    for sequence in range(40):
+        server.publish(stream, record, [sequence], sequence)
+        # At most the queue plus the record being sent are held
+        assert budget.used <= 5 * record.nbytes
+    assert time.perf_counter() - started < 2
+    assert client.dropped >= 40 - 5
+    assert server.skipped == 0
+
+    server.close()  # Gives up on the client that stopped reading
+    slow.close()
+    wait_for(lambda: budget.used == 0)
+    # Plus the newest record, reserved before the oldest queued one is dropped
+    assert budget.peak <= 6 * record.nbytes
+
+
+def test_records_that_do_not_fit_the_budget_are_skipped(budget, address):
+    record = np.ones((1, 2 ** 17))
+    budget.limit = record.nbytes // 2
+    server = StreamServer.open(address)
+    stream = server.add_stream(source(), np.float64, record.shape)
+    frames = []
+    reader = threading.Thread(target=lambda: frames.extend(read_frames(address)))
+    reader.start()
+    wait_for(lambda: server.clients)
+    server.publish(stream, record, [0], 0)
+    budget.limit = None
+    server.publish(stream, record, [1], 1)
+    server.close()
+    reader.join(timeout=5)
+    assert server.skipped == 1
+    assert [sequence for _, sequence, _, _, _ in frames] == [1]  # The gap shows the skipped record
+    assert budget.used == 0
+
+
+def test_actions_share_a_server_with_the_longest_queue(budget, address):
+    first = StreamServer.open(address, queue_length=8)
+    second = StreamServer.open(address, queue_length=32)
+    assert second is first
+    assert first.queue_length == 32
+    assert first.add_stream(source("A2D[0]"), np.float64, (1, 10)) == 0
+    assert first.add_stream(source("A2D[1]"), np.int16, (3, 10)) == 1
+    first.close()
+    assert StreamServer.open_servers[address] is first
+    second.close()
+    assert address not in StreamServer.open_servers
+
+
+def test_tcp(budget):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    address = f"tcp:127.0.0.1:{port}"
+    server = StreamServer.open(address)
+    stream = server.add_stream(source(), np.int16, (3,))
+    frames = []
+    reader = threading.Thread(target=lambda: frames.extend(read_frames(address)))
+    reader.start()
+    wait_for(lambda: server.clients)
+    server.publish(stream, np.array([1, 2, 3], dtype=np.int16), [], 5)
+    server.close()
+    reader.join(timeout=5)
+    assert [list(record) for _, _, _, _, record in frames] == [[1, 2, 3]]